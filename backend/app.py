@@ -1,23 +1,36 @@
  # app.py — Flask API server
 
 
+import csv
+import io
 import json
 import os
+import sys
+import threading
+import time
+import zlib
 
 
-from llm_router import generate as route_generate
-from flask import Flask, request, jsonify
-from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity
+from llm_router import (
+    generate as route_generate, generate_routed as route_generate_routed,
+    generate_many as route_generate_many,
+    stream as route_stream, warmup as warmup_model, ProviderUnavailable, guard_states,
+)
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from flask_jwt_extended import JWTManager, get_jwt_identity
 from flask_cors import CORS
-from auth import auth_bp
+from auth import auth_bp, jwt_required
+import metrics
+from prompts import build_structured_prompt
+from jobs import enqueue as enqueue_job, wait_for_job, start_workers as start_job_workers, QueueFull, queue_depth, saved_qaid
 from db import (
-    init_db, close_db,
-    save_qa, list_qa_for_user,
+    init_db, close_db, pool_stats,
+    save_qa, save_qa_many, list_qa_for_user, list_qa_page, search_qa_for_user, iter_qa_for_user,
     import_learning_objectives_xlsx,
     list_distinct_countries, list_distinct_languages, list_distinct_grades,
-    list_topics, list_objectives, combo_is_valid,
+    list_topics, list_objectives, combo_is_valid, curriculum_version,
     set_review,delete_all_qa_for_user, 
-    delete_qa,
+    delete_qa, get_qa, start_history_reaper,
 )
 
 
@@ -32,6 +45,43 @@ init_db()
 
 CORS(app, resources={r"/*": {"origins": "*"}})
 
+# Per-route latency for GET /metrics; labelled by the URL rule, not the raw path
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method, route=route, status=response.status_code,
+        )
+    return response
+
+def _qwen_batch_queue():
+    # Only once the Qwen backend has been used in this process
+    qwen = sys.modules.get("llm_qwen")
+    return qwen.batch_queue_depth() if qwen is not None else None
+
+metrics.Gauge("job_queue_depth", "Async generation jobs queued or running", callback=queue_depth)
+metrics.Gauge("qwen_batch_queue_depth", "Qwen requests waiting for the micro-batcher", callback=_qwen_batch_queue)
+metrics.Gauge("llm_circuit_open", "1 while a provider's circuit breaker is open or half-open", ("backend",),
+              callback=lambda: {(b,): int(s["state"] != "closed") for b, s in guard_states().items()})
+metrics.Gauge("llm_concurrency_limit", "Current adaptive concurrency limit per provider", ("backend",),
+              callback=lambda: {(b,): s["limit"] for b, s in guard_states().items()})
+metrics.Gauge("llm_inflight", "Provider calls in flight", ("backend",),
+              callback=lambda: {(b,): s["inflight"] for b, s in guard_states().items()})
+metrics.Gauge("db_pool_connections", "Pooled SQLite connections (open = idle + in use)", ("state",),
+              callback=lambda: {(k,): v for k, v in pool_stats().items()})
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of the counters in metrics.py (unauthenticated; keep it internal)."""
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
 @app.route("/")
 def home():
     return "<h1> FLASK REST API </h1>"
@@ -39,6 +89,20 @@ def home():
 #Explicit list of supported model keys as I removed the config.py
 MODELS = ["qwen", "gemini", "openai" ]
 
+# How long browsers may reuse /options/* responses before revalidating
+OPTIONS_MAX_AGE = int(os.getenv("OPTIONS_MAX_AGE", "300"))
+
+def _options_response(payload: dict):
+    """
+    JSON response for the dropdown endpoints with an ETag tied to the
+    curriculum version, so unchanged data is answered with 304 Not Modified.
+    """
+    resp = jsonify(payload)
+    resp.set_etag(curriculum_version())
+    resp.cache_control.public = True
+    resp.cache_control.max_age = OPTIONS_MAX_AGE
+    return resp.make_conditional(request)
+
 #For the frontend to call the dropdowns
 @app.get("/options/bootstrap")
 def bootstrap_options():
@@ -46,12 +110,12 @@ def bootstrap_options():
     Initial payload for populating base dropdowns (countries/grades/languages/models).
     All values come from the learning_objectives table (except models).
     """
-    return jsonify({
+    return _options_response({
         "countries": list_distinct_countries(),
         "grades":    list_distinct_grades(),
         "languages": list_distinct_languages(),
         "models":    MODELS,
-    }), 200
+    })
 
 #For the list of topics for the selected country, grade and language
 @app.get("/options/topics")
@@ -64,7 +128,7 @@ def options_topics():
     language = (request.args.get("language") or "").strip()
     if not (country and grade and language):
         return jsonify({"error": "country, grade, language required"}), 400
-    return jsonify({"topics": list_topics(country, grade, language)}), 200
+    return _options_response({"topics": list_topics(country, grade, language)})
 
 #For the list of learning objectives that matches the selected country, grade, language and topic
 @app.get("/options/objectives")
@@ -78,7 +142,7 @@ def options_objectives():
     topic    = (request.args.get("topic")    or "").strip()
     if not (country and grade and language and topic):
         return jsonify({"error": "country, grade, language, topic required"}), 400
-    return jsonify({"objectives": list_objectives(country, grade, language, topic)}), 200
+    return _options_response({"objectives": list_objectives(country, grade, language, topic)})
 
 #For the list of available languages filtered by country
 @app.get("/options/languages")
@@ -90,32 +154,29 @@ def options_languages():
     if not country:
         return jsonify({"error": "country required"}), 400
     langs = list_distinct_languages(country=country or None)
-    return jsonify({"languages": langs}), 200
+    return _options_response({"languages": langs})
 
 
-# POST /generate — bridges the HTTP request to Qwen3 via llm.generate()
-@app.post("/generate")
-@jwt_required()
-def generate_endpoint():
+def _prepare_generation(data: dict) -> tuple[str, str, dict, bool]:
     """
-    POST /generate
+    Turn a /generate request body into (prompt, model, meta, structured).
     Accepts either:
       - Raw: { prompt, model? }
       - Structured (recommended): {
             country, grade, language, topic, learning_objective?, model
         }
     Validates structured selections against DB-driven learning objectives.
+    structured is True for prompts built by build_structured_prompt; only
+    those ask the model for the shared answer format.
+    Raises ValueError with a user-facing message when the request is invalid.
     """
-    uid = int(get_jwt_identity())
-    data = request.get_json(silent=True) or {}
-
     # Raw prompt still supported
     prompt = (data.get("prompt") or "").strip()
 
     # Model validation (small static list)
     model = (data.get("model") or "qwen").strip().lower()
     if model not in MODELS:
-        return jsonify({"error": f"invalid model: {model}"}), 400
+        raise ValueError(f"invalid model: {model}")
 
     if not prompt:
         # Structured path
@@ -127,37 +188,68 @@ def generate_endpoint():
 
         # Basic completeness
         if not (country and grade and language and topic):
-            return jsonify({"error": "country, grade, language, topic required"}), 400
+            raise ValueError("country, grade, language, topic required")
 
         # Validate combo against DB; if LO given, validate the full quartet+LO
         if not combo_is_valid(country, grade, language, topic, lo if lo else None):
-            return jsonify({"error": "No matching entries for the given selection"}), 400
+            raise ValueError("No matching entries for the given selection")
 
         # Build prompt using the selected LO when provided
-        prompt = (
-            f"Create ONE short, correct, elementary-level math word problem for grade {grade} "
-            f"about {topic}. "
-            + (f"Align the question with this learning objective: '{lo}'. " if lo else "")
-            + f"Use culturally appropriate examples for {country}. "
-            f"Language: {language}. Keep it clear and age-appropriate."
-        )
+        prompt = build_structured_prompt(country, grade, language, topic, lo)
     else:
         # Raw path: keep behavior; no LO validation
         country = language = grade = topic = lo = ""
 
+    # Persist to history with meta so the UI can show the selections
+    meta = {
+        "country": country,
+        "grade": grade,
+        "language": language,
+        "topic": topic,
+        "learning_objective": lo,
+    }
+    return prompt, model, meta, bool(country)
+
+
+def _unavailable(e: ProviderUnavailable):
+    # Circuit open / concurrency limit hit for the model (see llm_guard)
+    retry = max(1, int(round(e.retry_after)))
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(retry)}
+
+
+# POST /generate — bridges the HTTP request to Qwen3 via llm.generate()
+@app.post("/generate")
+@jwt_required()
+def generate_endpoint():
+    """
+    POST /generate
+    Body as described in _prepare_generation; returns the full completion.
+    With ?async=1 it returns 202 { job_id, status_url } instead; poll
+    GET /jobs/<job_id> for the result.
+    """
+    uid = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+
+    try:
+        prompt, model, meta, structured = _prepare_generation(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # ?async=1: queue the generation and return a job id right away
+    if request.args.get("async") in ("1", "true"):
+        try:
+            job_id = enqueue_job(uid, {"prompt": prompt, "model": model, "meta": meta, "structured": structured})
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+        status_url = f"/jobs/{job_id}"
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
     try:
         # Give models enough headroom to respond succinctly across languages.
         # Gemini in particular can hit MAX_TOKENS with 256.
-        content = route_generate(prompt, model_key=model, max_new_tokens=768)
-
-        # Persist to history with meta so the UI can show the selections
-        meta = {
-            "country": country,
-            "grade": grade,
-            "language": language,
-            "topic": topic,
-            "learning_objective": lo,
-        }
+        # The routing policy may hedge/fail over to another backend; record the one that answered.
+        content, model = route_generate_routed(prompt, model_key=model, max_new_tokens=768, structured=structured)
+
         qaid = save_qa(uid, prompt, content, model, meta=meta)
 
         return jsonify({
@@ -168,57 +260,316 @@ def generate_endpoint():
             "meta": meta,
         }), 200
 
+    except ProviderUnavailable as e:
+        return _unavailable(e)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+# Worksheet generation limits
+GENERATE_BATCH_MAX_ITEMS = int(os.getenv("GENERATE_BATCH_MAX_ITEMS", "50"))
+GENERATE_BATCH_CONCURRENCY = int(os.getenv("GENERATE_BATCH_CONCURRENCY", "4"))
+
+# POST /generate/batch — many generations in one request (e.g. a worksheet)
+@app.post("/generate/batch")
+@jwt_required()
+def generate_batch_endpoint():
+    """
+    POST /generate/batch
+    Accepts either:
+      - { items: [ <same body as /generate>, ... ] }
+      - <same body as /generate> plus { count: N } for N problems from one selection
+    Generations run concurrently (see llm_router.generate_many) and all
+    successful results are saved in one transaction. Returns
+    { results: [ {qaid, prompt, content, model_used, meta} | {error} ] }
+    in request order.
+    """
+    uid = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+
+    items = data.get("items")
+    if items is None:
+        try:
+            count = int(data.get("count") or 1)
+        except (TypeError, ValueError):
+            return jsonify({"error": "count must be an integer"}), 400
+        items = [data] * count
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "items must be a non-empty list"}), 400
+    if len(items) > GENERATE_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"at most {GENERATE_BATCH_MAX_ITEMS} items per batch"}), 400
+
+    prepared = []
+    for i, item in enumerate(items):
+        try:
+            prepared.append(_prepare_generation(item if isinstance(item, dict) else {}))
+        except ValueError as e:
+            return jsonify({"error": f"item {i}: {e}"}), 400
+
+    outputs = route_generate_many(
+        [(prompt, model, structured) for prompt, model, _, structured in prepared],
+        max_new_tokens=768,
+        concurrency=GENERATE_BATCH_CONCURRENCY,
+    )
+
+    ok = [
+        (i, prompt, content, model, meta)
+        for i, ((prompt, model, meta, _), content) in enumerate(zip(prepared, outputs))
+        if not isinstance(content, Exception)
+    ]
+    qaids = save_qa_many(uid, [(prompt, content, model, meta) for _, prompt, content, model, meta in ok])
+
+    results = [{"error": str(out)} for out in outputs]
+    for qaid, (i, prompt, content, model, meta) in zip(qaids, ok):
+        results[i] = {
+            "qaid": qaid,
+            "prompt": prompt,
+            "content": content,
+            "model_used": model,
+            "meta": meta,
+        }
+    return jsonify({"results": results}), 200
+
+
+def _run_generation_job(uid: int, payload: dict, job_id: str) -> dict:
+    """Job handler for POST /generate?async=1 (runs on a jobs.py worker thread)."""
+    prompt, model, meta = payload["prompt"], payload["model"], payload["meta"]
+    qaid = saved_qaid(job_id)
+    row = get_qa(qaid, uid) if qaid else None
+    if row is not None:
+        # An earlier attempt saved its answer but died before finishing the job
+        content, model = row["answer"], row["model"]
+    else:
+        content, model = route_generate_routed(prompt, model_key=model, max_new_tokens=768,
+                                               structured=payload.get("structured", False))
+        qaid = save_qa(uid, prompt, content, model, meta=meta, job_id=job_id)
+    return {
+        "qaid": qaid,
+        "prompt": prompt,
+        "content": content,
+        "model_used": model,
+        "meta": meta,
+    }
+
+# GET /jobs/<id> — status/result of an async generation (?wait=N long-polls up to N seconds)
+@app.get("/jobs/<job_id>")
+@jwt_required()
+def job_status(job_id):
+    uid = int(get_jwt_identity())
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0.0), 30.0)
+    except ValueError:
+        wait = 0.0
+    job = wait_for_job(job_id, uid, timeout=wait)
+    if job is None:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(job), 200
+
+start_job_workers(app, _run_generation_job)
+start_history_reaper()
+
+
+def _sse(event: str, payload: dict) -> str:
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+# POST /generate/stream — same as /generate but streams tokens as Server-Sent Events
+@app.post("/generate/stream")
+@jwt_required()
+def generate_stream_endpoint():
+    """
+    POST /generate/stream
+    Same body as /generate. Responds with text/event-stream:
+      event: token  data: {"text": "..."}        (repeated as text is produced)
+      event: done   data: {qaid, prompt, content, model_used, meta}
+      event: error  data: {"error": "..."}
+    The full text is saved to history once the stream completes.
+    """
+    uid = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+
+    try:
+        prompt, model, meta, structured = _prepare_generation(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def events():
+        parts = []
+        try:
+            for chunk in route_stream(prompt, model_key=model, max_new_tokens=768, structured=structured):
+                parts.append(chunk)
+                yield _sse("token", {"text": chunk})
+
+            content = "".join(parts).strip()
+            qaid = save_qa(uid, prompt, content, model, meta=meta)
+            yield _sse("done", {
+                "qaid": qaid,
+                "prompt": prompt,
+                "content": content,
+                "model_used": model,
+                "meta": meta,
+            })
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
     
  # ADDED: GET /history — list recent Q&A for the current user
+def _history_item(row) -> dict:
+    """Convert a qa_pairs row to the JSON shape the UI expects (meta parsed)."""
+    item = dict(row)  # convert sqlite3.Row to dict
+    item.pop("rowid", None)
+    if "meta_json" in item and item["meta_json"]:
+        try:
+            item["meta"] = json.loads(item["meta_json"])
+        except json.JSONDecodeError:
+            item["meta"] = {}
+        del item["meta_json"]
+    return item
+
 @app.get("/history")
 @jwt_required()
 def history():
     """
     GET /history
     Returns recent Q&A for the current user with parsed meta (if present).
+      - ?before=<cursor>&limit=N  (cursor pagination; pass an empty `before`
+        for the first page) -> { items: [...], next_cursor: str | null }
+      - ?limit=N&offset=M         (legacy) -> [...]
     """
     uid = int(get_jwt_identity())
     limit  = int(request.args.get("limit", 20))
-    offset = int(request.args.get("offset", 0))
 
-    rows = list_qa_for_user(uid, limit=limit, offset=offset)
+    if "before" in request.args:
+        try:
+            rows, next_cursor = list_qa_page(uid, limit=min(max(limit, 1), 100), before=request.args.get("before") or None)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({
+            "items": [_history_item(r) for r in rows],
+            "next_cursor": next_cursor,
+        }), 200
 
-    out = []
-    for r in rows:
-        item = dict(r)  # convert sqlite3.Row to dict
-        if "meta_json" in item and item["meta_json"]:
-            try:
-                item["meta"] = json.loads(item["meta_json"])
-            except json.JSONDecodeError:
-                item["meta"] = {}
-            del item["meta_json"]
-        out.append(item)
+    offset = int(request.args.get("offset", 0))
+    rows = list_qa_for_user(uid, limit=limit, offset=offset)
+    return jsonify([_history_item(r) for r in rows]), 200
 
-    return jsonify(out), 200
+# GET /history/search?q= — full-text search over the user's saved history
+@app.get("/history/search")
+@jwt_required()
+def history_search():
+    """
+    GET /history/search?q=<text>&limit=N
+    Ranked matches across question, answer, topic and learning objective.
+    Returns { items: [...] }; each item has a `snippet` with <mark> highlights.
+    """
+    uid = int(get_jwt_identity())
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "q required"}), 400
+    limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+    rows = search_qa_for_user(uid, q, limit=limit)
+    return jsonify({"items": [_history_item(r) for r in rows]}), 200
+
+EXPORT_COLUMNS = ["qaid", "created_at", "model", "question", "answer",
+                  "review_score", "review_text", "review_at", "meta_json"]
+
+def _export_ndjson(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(_history_item(r), ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+
+def _export_csv(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        writer.writerows([r[c] for c in EXPORT_COLUMNS] for r in rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")  # header only: the user has no history
+
+def _gzip_stream(parts):
+    # wbits=31 -> gzip container; output is flushed in whatever blocks zlib emits
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for part in parts:
+        out = z.compress(part)
+        if out:
+            yield out
+    yield z.flush()
+
+# GET /history/export — the user's whole history as a download
+@app.get("/history/export")
+@jwt_required()
+def history_export():
+    """
+    GET /history/export?format=ndjson|csv
+    Streams every saved Q&A (newest first) while reading it from the DB in
+    chunks, so memory use does not grow with the size of the account.
+      - ndjson: one /history item per line (meta parsed)
+      - csv:    EXPORT_COLUMNS, meta as its raw JSON string
+    Gzip-compressed on the fly when the client sends Accept-Encoding: gzip.
+    """
+    uid = int(get_jwt_identity())
+    fmt = (request.args.get("format") or "ndjson").lower()
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+
+    chunks = iter_qa_for_user(uid)
+    body = _export_ndjson(chunks) if fmt == "ndjson" else _export_csv(chunks)
+    headers = {
+        "Content-Disposition": f'attachment; filename="history.{fmt}"',
+        "Cache-Control": "no-store",
+        "Vary": "Accept-Encoding",
+    }
+    # Quality, not membership: "gzip;q=0" means the client refuses gzip
+    if request.accept_encodings["gzip"] > 0:
+        body = _gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        stream_with_context(body),
+        mimetype="application/x-ndjson" if fmt == "ndjson" else "text/csv",
+        headers=headers,
+    )
 
 #Auto import Excel sheet on startup
 try:
     DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "maths LOs.xlsx")
     if os.path.exists(DATA_PATH):
         with app.app_context():
-            import_learning_objectives_xlsx(DATA_PATH)
-            print("Learning objectives imported from:", DATA_PATH)
+            # Skips parsing when the workbook is unchanged since the last import;
+            # replace=True keeps the table in sync with rows deleted from the sheet.
+            if import_learning_objectives_xlsx(DATA_PATH, replace=True):
+                print("Learning objectives imported from:", DATA_PATH)
+            else:
+                print("Learning objectives up to date:", DATA_PATH)
     else:
         print("WARNING: LO spreadsheet not found at", DATA_PATH)
 except Exception as e:
     print("ERROR importing LOs on startup:", e)
 
+# Optional: load the local Qwen model in the background at startup instead of on
+# the first qwen request (QWEN_WARMUP=1).
+if os.getenv("QWEN_WARMUP") == "1":
+    threading.Thread(target=warmup_model, args=("qwen",), name="qwen-warmup", daemon=True).start()
+
 @app.post("/api/chat")
 def api_chat():
     data = request.get_json(force=True, silent=True) or {}
     try:
         reply = route_generate(data.get("message",""), data.get("model","openai"))
         return jsonify({"reply": reply}), 200
+    except ProviderUnavailable as e:
+        return _unavailable(e)
     except Exception as e:
         print("LLM error:", e)
         return jsonify({"error": str(e)}), 500
@@ -249,7 +600,7 @@ def review_endpoint(qaid):
 @jwt_required()
 def clear_history():
     uid = int(get_jwt_identity())
-    n = delete_all_qa_for_user(uid)
+    delete_all_qa_for_user(uid)
     return ("", 204)
 
 @app.delete("/history/<qaid>")
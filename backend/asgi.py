@@ -0,0 +1,171 @@
+# asgi.py — async entry point for the Flask app
+"""
+Run with an ASGI server instead of `python app.py`, e.g.:
+
+    uvicorn asgi:application --host 127.0.0.1 --port 8080
+
+POST /generate and POST /api/chat are served natively on the event loop via
+llm_router.agenerate, so hundreds of in-flight OpenAI/Gemini calls share one
+thread instead of holding one Flask worker thread each. Every other route
+(and /generate?async=1) is passed through to the unchanged Flask app.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import decode_token
+
+from app import app, _prepare_generation
+from db import save_qa
+from llm_router import ProviderUnavailable, agenerate, agenerate_routed
+from metrics import HTTP_SECONDS
+
+_flask = WsgiToAsgi(app)
+
+
+async def _read_json(receive) -> dict:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def _send_json(send, status: int, payload: dict, headers: list = ()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            # Same policy as CORS(app) for the Flask routes
+            (b"access-control-allow-origin", b"*"),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _in_app_context(fn, *args, **kwargs):
+    # DB helpers rely on Flask's app context (get_db caches on g)
+    with app.app_context():
+        return fn(*args, **kwargs)
+
+
+def _identity(scope) -> int:
+    """User id from the Bearer token, verified like @jwt_required(). Raises on failure."""
+    headers = dict(scope.get("headers") or [])
+    auth = headers.get(b"authorization", b"").decode("latin-1")
+    if not auth.startswith("Bearer "):
+        raise PermissionError("Missing Authorization Header")
+    with app.app_context():
+        claims = decode_token(auth[len("Bearer "):].strip())
+    if claims.get("type") != "access":
+        raise PermissionError("Only access tokens are allowed")
+    return int(claims["sub"])
+
+
+async def _send_unavailable(send, e: ProviderUnavailable):
+    retry = str(max(1, int(round(e.retry_after)))).encode()
+    await _send_json(send, 503, {"error": str(e)}, [(b"retry-after", retry)])
+
+
+async def _generate(scope, receive, send):
+    try:
+        uid = _identity(scope)
+    except Exception as e:
+        return await _send_json(send, 401, {"msg": str(e)})
+
+    data = await _read_json(receive)
+    try:
+        prompt, model, meta, structured = await asyncio.to_thread(_in_app_context, _prepare_generation, data)
+    except ValueError as e:
+        return await _send_json(send, 400, {"error": str(e)})
+
+    try:
+        content, model = await agenerate_routed(prompt, model, max_new_tokens=768, structured=structured)
+        qaid = await asyncio.to_thread(_in_app_context, save_qa, uid, prompt, content, model, meta=meta)
+    except ProviderUnavailable as e:
+        return await _send_unavailable(send, e)
+    except Exception as e:
+        return await _send_json(send, 500, {"error": str(e)})
+
+    await _send_json(send, 200, {
+        "qaid": qaid,
+        "prompt": prompt,
+        "content": content,
+        "model_used": model,
+        "meta": meta,
+    })
+
+
+async def _chat(scope, receive, send):
+    data = await _read_json(receive)
+    try:
+        reply = await agenerate(data.get("message", ""), data.get("model", "openai"))
+    except ProviderUnavailable as e:
+        return await _send_unavailable(send, e)
+    except Exception as e:
+        print("LLM error:", e)
+        return await _send_json(send, 500, {"error": str(e)})
+    await _send_json(send, 200, {"reply": reply})
+
+
+async def _timed(handler, scope, receive, send):
+    # Same latency metric the Flask routes record in app.after_request
+    started = time.perf_counter()
+    status = 500
+
+    async def send_and_note(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    try:
+        await handler(scope, receive, send_and_note)
+    finally:
+        HTTP_SECONDS.observe(time.perf_counter() - started,
+                             method=scope["method"], route=scope["path"], status=status)
+
+
+_ASYNC_ROUTES = {
+    "/generate": _generate,
+    "/api/chat": _chat,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    if scope["type"] == "http" and scope["method"] == "POST":
+        handler = _ASYNC_ROUTES.get(scope["path"])
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        # The job-queue variant stays on Flask
+        if handler is not None and not query.get("async"):
+            return await _timed(handler, scope, receive, send)
+
+    await _flask(scope, receive, send)
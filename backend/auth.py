@@ -1,14 +1,29 @@
 # auth.py
-from flask import Blueprint, request, jsonify
+from functools import wraps
+
+from flask import Blueprint, current_app, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import (
-    create_access_token, jwt_required, get_jwt_identity
+    create_access_token, get_jwt_identity, verify_jwt_in_request
 )
 from db import create_user, get_user_by_email, get_user_by_username, get_user_by_id
+from metrics import JWT_SECONDS
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 
+#Same as flask_jwt_extended.jwt_required(), but records how long token verification takes
+def jwt_required(**options):
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            with JWT_SECONDS.time():
+                verify_jwt_in_request(**options)
+            return current_app.ensure_sync(fn)(*args, **kwargs)
+        return decorator
+    return wrapper
+
+
 #This is the /register route handler in the authentication system.This is used to let a new user sign up with email, username and password
 @auth_bp.route("/register", methods=["POST"])
 def register():
@@ -0,0 +1,71 @@
+# _common.py — helpers shared by the benchmark scripts
+from __future__ import annotations
+
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def percentile(sorted_values: list, p: float):
+    """Nearest-rank percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies: list, wall_seconds: float, errors: int = 0) -> dict:
+    """Latency percentiles (ms) and throughput for one measured scenario."""
+    lat = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None  # noqa: E731
+    return {
+        "requests": len(lat) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(lat) / wall_seconds, 2) if wall_seconds > 0 else None,
+        "mean_ms": ms(sum(lat) / len(lat)) if lat else None,
+        "p50_ms": ms(percentile(lat, 50)),
+        "p95_ms": ms(percentile(lat, 95)),
+        "p99_ms": ms(percentile(lat, 99)),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def write_results(path: str | None, suite: str, params: dict, results: list):
+    """Print the results table and, if path is given, save them as JSON for compare.py."""
+    doc = {
+        "suite": suite,
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "params": params,
+        },
+        "results": results,
+    }
+    cols = ("name", "concurrency", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "errors")
+    print("  ".join(f"{c:>16}" for c in cols))
+    for r in results:
+        print("  ".join(f"{str(r.get(c, '')):>16}" for c in cols))
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=2)
+        print("wrote", path)
+    return doc
@@ -0,0 +1,242 @@
+# api_load.py — throughput / latency of the main API endpoints under concurrency
+"""
+Starts benchmarks/stub_server.py (fake LLM backends, throwaway SQLite file)
+and drives each endpoint with N concurrent keep-alive clients for a fixed
+time, reporting throughput and p50/p95/p99 latency per (endpoint, N).
+
+    cd backend
+    python benchmarks/api_load.py                                  # defaults
+    python benchmarks/api_load.py --concurrency 1 8 32 --duration 15 --json base.json
+    python benchmarks/api_load.py --url http://127.0.0.1:8080     # an already running server
+
+Scenarios: generate (POST /generate, structured body), history
+(GET /history), history_page (GET /history?before=), options
+(GET /options/bootstrap + /options/topics) and login (POST /auth/login).
+Compare two runs with benchmarks/compare.py.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+from _common import summarize, write_results
+
+SCENARIOS = ("generate", "history", "history_page", "options", "login")
+
+
+class _Client:
+    """One keep-alive connection (reopened transparently if the server closes it)."""
+
+    def __init__(self, base_url: str, token: str | None = None):
+        parts = urlsplit(base_url)
+        self._conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=120)
+        self._headers = {"Content-Type": "application/json"}
+        if token:
+            self._headers["Authorization"] = f"Bearer {token}"
+
+    def request(self, method: str, path: str, body: dict | None = None):
+        data = json.dumps(body).encode() if body is not None else None
+        try:
+            self._conn.request(method, path, body=data, headers=self._headers)
+            resp = self._conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            self._conn.close()
+            self._conn.request(method, path, body=data, headers=self._headers)
+            resp = self._conn.getresponse()
+        payload = resp.read()
+        if resp.getheader("Connection", "").lower() == "close" or resp.version == 10:
+            self._conn.close()
+        return resp.status, payload
+
+    def close(self):
+        # The next request opens a fresh connection
+        self._conn.close()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_stub(latency_ms: float, workdir: str):
+    port = _free_port()
+    here = os.path.dirname(os.path.abspath(__file__))
+    # The server logs every request; a file (unlike an unread pipe) never fills up and blocks it
+    log_path = os.path.join(workdir, "stub_server.log")
+    with open(log_path, "wb") as log:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(here, "stub_server.py"), "--port", str(port),
+             "--latency-ms", str(latency_ms), "--db", os.path.join(workdir, "bench.db")],
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            with open(log_path, encoding="utf-8", errors="replace") as f:
+                raise RuntimeError("stub server exited:\n" + f.read())
+        try:
+            if _Client(url).request("GET", "/")[0] == 200:
+                return proc, url
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("stub server did not start")
+
+
+def _setup(url: str, seed_history: int) -> dict:
+    """Create a user, find a valid curriculum selection and seed some history."""
+    anon = _Client(url)
+    email = f"bench-{uuid.uuid4().hex[:8]}@example.com"
+    password = "bench-password"
+    status, _ = anon.request("POST", "/auth/register", {"email": email, "username": email, "password": password})
+    if status != 201:
+        raise RuntimeError(f"register failed: {status}")
+    status, body = anon.request("POST", "/auth/login", {"email": email, "password": password})
+    token = json.loads(body)["access_token"]
+
+    boot = json.loads(anon.request("GET", "/options/bootstrap")[1])
+    selection = None
+    for country in boot["countries"]:
+        for grade in boot["grades"]:
+            for language in boot["languages"]:
+                query = urlencode({"country": country, "grade": grade, "language": language})
+                topics = json.loads(anon.request("GET", f"/options/topics?{query}")[1]).get("topics") or []
+                if topics:
+                    selection = {"country": country, "grade": grade, "language": language, "topic": topics[0]}
+                    break
+            if selection:
+                break
+        if selection:
+            break
+    if selection is None:
+        raise RuntimeError("no curriculum data: is backend/data/maths LOs.xlsx present?")
+
+    authed = _Client(url, token)
+    body = dict(selection, model="openai")
+    for _ in range(seed_history):
+        authed.request("POST", "/generate", body)
+    cursor = json.loads(authed.request("GET", "/history?before=&limit=20")[1]).get("next_cursor") or ""
+    return {"email": email, "password": password, "token": token, "selection": selection, "cursor": cursor}
+
+
+def _scenario(name: str, ctx: dict):
+    """(needs auth, function(client) -> status) for one scenario."""
+    sel = ctx["selection"]
+    topics_qs = urlencode({k: sel[k] for k in ("country", "grade", "language")})
+    if name == "generate":
+        body = dict(sel, model="openai")
+        return True, lambda c: c.request("POST", "/generate", body)[0]
+    if name == "history":
+        return True, lambda c: c.request("GET", "/history?limit=20")[0]
+    if name == "history_page":
+        path = "/history?" + urlencode({"limit": 20, "before": ctx["cursor"]})
+        return True, lambda c: c.request("GET", path)[0]
+    if name == "options":
+        def options(c):
+            status = c.request("GET", "/options/bootstrap")[0]
+            return status if status >= 400 else c.request("GET", f"/options/topics?{topics_qs}")[0]
+        return False, options
+    if name == "login":
+        creds = {"email": ctx["email"], "password": ctx["password"]}
+        return False, lambda c: c.request("POST", "/auth/login", creds)[0]
+    raise ValueError(name)
+
+
+def run_scenario(url: str, ctx: dict, name: str, concurrency: int, duration: float, warmup: float) -> dict:
+    needs_auth, call = _scenario(name, ctx)
+    latencies: list = []
+    errors = [0]
+    lock = threading.Lock()
+    start_gate = threading.Barrier(concurrency + 1)
+    bounds = {}
+
+    def worker():
+        client = _Client(url, ctx["token"] if needs_auth else None)
+        mine, failed = [], 0
+        start_gate.wait()
+        while time.perf_counter() < bounds["end"]:
+            t0 = time.perf_counter()
+            try:
+                ok = call(client) < 400
+            except (OSError, http.client.HTTPException):
+                # e.g. a timeout or a malformed/truncated response: the
+                # connection's state is unknown, so start over on a new one
+                ok = False
+                client.close()
+            t1 = time.perf_counter()
+            if t0 < bounds["measure_from"]:
+                continue  # warm-up
+            if ok:
+                mine.append(t1 - t0)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    now = time.perf_counter()
+    bounds["measure_from"] = now + warmup
+    bounds["end"] = now + warmup + duration
+    start_gate.wait()
+    for t in threads:
+        t.join()
+    result = {"name": name, "concurrency": concurrency}
+    result.update(summarize(latencies, duration, errors[0]))
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="benchmark a running server instead of starting the stub server")
+    ap.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    ap.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    ap.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    ap.add_argument("--warmup", type=float, default=1.0, help="unmeasured seconds before each scenario")
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="fake LLM latency for the stub server")
+    ap.add_argument("--seed-history", type=int, default=60, help="generations saved before measuring")
+    ap.add_argument("--json", metavar="PATH", help="write results for compare.py")
+    args = ap.parse_args()
+
+    proc = None
+    tmpdir = None
+    url = args.url
+    if not url:
+        tmpdir = tempfile.TemporaryDirectory(prefix="mathapp-bench-")
+        proc, url = _start_stub(args.latency_ms, tmpdir.name)
+    try:
+        ctx = _setup(url, args.seed_history)
+        results = []
+        for name in args.scenarios:
+            for n in args.concurrency:
+                print(f"{name} x{n} ...", file=sys.stderr)
+                results.append(run_scenario(url, ctx, name, n, args.duration, args.warmup))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if tmpdir is not None:
+            tmpdir.cleanup()
+
+    params = {k: getattr(args, k) for k in ("scenarios", "concurrency", "duration", "latency_ms", "seed_history")}
+    params["url"] = args.url or "stub"
+    write_results(args.json, "api", params, results)
+
+
+if __name__ == "__main__":
+    main()
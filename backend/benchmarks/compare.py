@@ -0,0 +1,74 @@
+# compare.py — diff two benchmark result files and flag regressions
+"""
+    python benchmarks/compare.py base.json new.json [--threshold 10]
+
+Matches results by (name, concurrency) and prints the change in throughput
+and p50/p95/p99. Exits with status 1 when any p95/p99 got slower, or any
+throughput dropped, by more than --threshold percent, so it can gate CI.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+
+# metric -> True when higher is better
+METRICS = {"throughput_rps": True, "p50_ms": False, "p95_ms": False, "p99_ms": False}
+GATED = ("throughput_rps", "p95_ms", "p99_ms")
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100.0
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    """Rows of (name, concurrency, metric, old, new, change %, regressed)."""
+    if base.get("suite") != new.get("suite"):
+        raise SystemExit(f"different suites: {base.get('suite')} vs {new.get('suite')}")
+    old_by_key = {(r["name"], r.get("concurrency")): r for r in base["results"]}
+    rows = []
+    for r in new["results"]:
+        old = old_by_key.get((r["name"], r.get("concurrency")))
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            change = _change(old.get(metric), r.get(metric))
+            worse = change is not None and (-change if higher_is_better else change) > threshold
+            rows.append((r["name"], r.get("concurrency"), metric, old.get(metric), r.get(metric),
+                         change, worse and metric in GATED))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("base")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    args = ap.parse_args()
+
+    base, new = _load(args.base), _load(args.new)
+    print(f"base: {base['meta'].get('commit')} {base['meta'].get('timestamp')}")
+    print(f"new:  {new['meta'].get('commit')} {new['meta'].get('timestamp')}")
+    rows = compare(base, new, args.threshold)
+
+    regressions = 0
+    for name, conc, metric, old, cur, change, regressed in rows:
+        mark = "  REGRESSION" if regressed else ""
+        pct = f"{change:+7.1f}%" if change is not None else "      -"
+        print(f"{name:>30} x{conc!s:<4} {metric:>15} {old!s:>12} -> {cur!s:>12} {pct}{mark}")
+        regressions += regressed
+    if regressions:
+        print(f"{regressions} regression(s) beyond {args.threshold:.0f}%")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
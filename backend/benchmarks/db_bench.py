@@ -0,0 +1,218 @@
+# db_bench.py — microbenchmarks for db.py on a large synthetic history table
+"""
+Builds (once) a SQLite file with a multi-million-row qa_pairs table spread
+over many users, then times the db.py functions the API calls on every
+request, single-threaded, reporting p50/p95/p99 per function.
+
+    cd backend
+    python benchmarks/db_bench.py                                 # 2M rows in /tmp/mathapp-bench.db
+    python benchmarks/db_bench.py --rows 5000000 --users 2000 --json db.json
+    python benchmarks/db_bench.py --rebuild                       # discard and rebuild the table
+
+The database is reused across runs (rebuilding millions of rows, including
+the full-text index, takes minutes), so compare runs made on the same file.
+
+Before timing anything it checks the EXPLAIN QUERY PLAN of the hot queries
+and exits with status 1 if one of them lost its index (--explain prints the
+plans as well).
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import sys
+import time
+import uuid
+
+from _common import BACKEND_DIR, summarize, write_results
+
+WORDS = (
+    "apples mangoes rupees lek buses trains tickets marbles books pencils coconuts rice "
+    "fractions decimals addition subtraction multiplication division area perimeter time "
+    "money length weight capacity shapes angles patterns tea market school festival garden"
+).split()
+TOPICS = ("Fractions", "Addition", "Subtraction", "Multiplication", "Measurement", "Money", "Time", "Geometry")
+
+
+def _sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def build(db_path: str, rows: int, users: int, seed: int = 7):
+    import db
+
+    db.init_db()
+    con = db._connect()
+    rng = random.Random(seed)
+    have = con.execute("SELECT COUNT(*) FROM qa_pairs").fetchone()[0]
+    if have >= rows:
+        con.close()
+        return have
+
+    with con:
+        con.executemany(
+            "INSERT OR IGNORE INTO users(id, email, username, password_hash) VALUES (?,?,?,?)",
+            [(u, f"user{u}@bench", f"user{u}", "x") for u in range(1, users + 1)],
+        )
+
+    start = datetime.datetime(2024, 1, 1)
+    chunk = 50_000
+    started = time.perf_counter()
+    for base in range(have, rows, chunk):
+        batch = []
+        for i in range(base, min(rows, base + chunk)):
+            topic = rng.choice(TOPICS)
+            meta = {"country": "Sri Lanka", "grade": str(rng.randint(3, 5)), "language": "English",
+                    "topic": topic, "learning_objective": _sentence(rng, 6)}
+            batch.append((
+                str(uuid.UUID(int=rng.getrandbits(128))),
+                # Skewed towards low user ids so some users have deep histories
+                min(users, int(rng.paretovariate(1.2))) if rng.random() < 0.5 else rng.randint(1, users),
+                _sentence(rng, 25),
+                "**Math Word Problem:**\n" + _sentence(rng, 30),
+                rng.choice(("qwen", "gemini", "openai")),
+                json.dumps(meta),
+                (start + datetime.timedelta(seconds=i * 7)).strftime("%Y-%m-%d %H:%M:%S"),
+            ))
+        with con:
+            con.executemany(
+                """INSERT INTO qa_pairs (qaid, user_id, question, answer, model, meta_json, created_at)
+                   VALUES (?,?,?,?,?,?,?)""",
+                batch,
+            )
+        done = min(rows, base + chunk)
+        rate = (done - have) / (time.perf_counter() - started)
+        print(f"  {done:,}/{rows:,} rows ({rate:,.0f} rows/s)", file=sys.stderr)
+    con.execute("ANALYZE")
+    con.close()
+    return rows
+
+
+def _plan_checks(hot_user: int):
+    """(name, sql, params, patterns the plan must contain, patterns it must not)."""
+    import db
+
+    return [
+        # The user filter is inside the MATCH (fts5 constraint "M") and
+        # qa_pairs is only touched by rowid for the hits
+        ("search_qa_for_user", db._SEARCH_QA_SQL, (db._user_fts_query(hot_user, "mangoes fract"), hot_user, 20),
+         [r"VIRTUAL TABLE INDEX 0:M", r"SEARCH q USING INTEGER PRIMARY KEY"], [r"SCAN q\b"]),
+        # History pages walk idx_qa_user_epoch_time in order, never sorting
+        ("list_qa_page", """
+            SELECT qaid, question, answer, created_at, rowid FROM qa_pairs
+            WHERE user_id=:uid AND epoch=(SELECT history_epoch FROM users WHERE id=:uid)
+              AND created_at <= :ts AND (created_at < :ts OR rowid < :rid)
+            ORDER BY created_at DESC, rowid DESC LIMIT 21
+         """, {"uid": hot_user, "ts": "2100-01-01 00:00:00", "rid": 2**62},
+         [r"USING (COVERING )?INDEX idx_qa_user_epoch_time"], [r"TEMP B-TREE"]),
+    ]
+
+
+def check_plans(con, hot_user: int, show: bool = False) -> list:
+    """Run EXPLAIN QUERY PLAN for _plan_checks(); returns the problems found."""
+    problems = []
+    for name, sql, params, required, forbidden in _plan_checks(hot_user):
+        plan = [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        if show:
+            print(f"{name}:\n  " + "\n  ".join(plan), file=sys.stderr)
+        text = "\n".join(plan)
+        problems += [f"{name}: plan lacks {want!r}" for want in required if not re.search(want, text)]
+        problems += [f"{name}: plan has {bad!r}" for bad in forbidden if re.search(bad, text)]
+    return problems
+
+
+def _cases(hot_user: int, cursor: str, qaid: str):
+    import db
+
+    counter = iter(range(10**9))
+    return [
+        ("list_qa_for_user", lambda: db.list_qa_for_user(hot_user, limit=20)),
+        ("list_qa_for_user_offset_2000", lambda: db.list_qa_for_user(hot_user, limit=20, offset=2000)),
+        ("list_qa_page_first", lambda: db.list_qa_page(hot_user, limit=20)),
+        ("list_qa_page_deep", lambda: db.list_qa_page(hot_user, limit=20, before=cursor)),
+        ("search_qa_for_user", lambda: db.search_qa_for_user(hot_user, "mangoes fract", limit=20)),
+        ("get_qa", lambda: db.get_qa(qaid, hot_user)),
+        ("set_review", lambda: db.set_review(hot_user, qaid, 1, f"good {next(counter)}")),
+        ("save_qa", lambda: db.save_qa(hot_user, "bench question", "bench answer", "openai",
+                                       meta={"topic": "Fractions"})),
+        ("list_topics", lambda: db.list_topics("Sri Lanka", "3", "English")),
+        ("combo_is_valid", lambda: db.combo_is_valid("Sri Lanka", "3", "English", "Fractions")),
+    ]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", default=os.path.join("/tmp", "mathapp-bench.db"))
+    ap.add_argument("--rows", type=int, default=2_000_000)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--iterations", type=int, default=300)
+    ap.add_argument("--rebuild", action="store_true")
+    ap.add_argument("--only", nargs="+", help="run only these cases")
+    ap.add_argument("--json", metavar="PATH", help="write results for compare.py")
+    ap.add_argument("--explain", action="store_true", help="print the query plans that are checked")
+    args = ap.parse_args()
+
+    args.db = os.path.abspath(args.db)
+    if args.rebuild:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+    os.environ["APP_DB_PATH"] = args.db
+    os.chdir(BACKEND_DIR)
+
+    from flask import Flask
+    import db
+
+    print(f"preparing {args.db} ...", file=sys.stderr)
+    rows = build(args.db, args.rows, args.users)
+    app = Flask("db_bench")
+    app.teardown_appcontext(db.close_db)
+    xlsx = os.path.join(BACKEND_DIR, "data", "maths LOs.xlsx")
+    if os.path.exists(xlsx):
+        with app.app_context():
+            db.import_learning_objectives_xlsx(xlsx, replace=True)
+    con = db._connect()
+    hot_user = con.execute(
+        "SELECT user_id FROM qa_pairs GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1"
+    ).fetchone()[0]
+    history = con.execute("SELECT COUNT(*) FROM qa_pairs WHERE user_id=?", (hot_user,)).fetchone()[0]
+    problems = check_plans(con, hot_user, show=args.explain)
+    con.close()
+    if problems:
+        print("query plan check failed:\n  " + "\n  ".join(problems), file=sys.stderr)
+        sys.exit(1)
+
+    with app.app_context():
+        # A cursor ~2000 rows deep, the same depth as the OFFSET case
+        cursor = None
+        for _ in range(100):
+            _, cursor = db.list_qa_page(hot_user, limit=20, before=cursor)
+        qaid = db.list_qa_for_user(hot_user, limit=1)[0]["qaid"]
+
+    results = []
+    for name, fn in _cases(hot_user, cursor, qaid):
+        if args.only and name not in args.only:
+            continue
+        latencies = []
+        wall = time.perf_counter()
+        for _ in range(args.iterations):
+            # One app context per call, like one request
+            with app.app_context():
+                t0 = time.perf_counter()
+                fn()
+                latencies.append(time.perf_counter() - t0)
+        result = {"name": name, "concurrency": 1}
+        result.update(summarize(latencies, time.perf_counter() - wall))
+        results.append(result)
+
+    params = {"rows": rows, "users": args.users, "hot_user_rows": history, "iterations": args.iterations}
+    write_results(args.json, "db", params, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# qwen_profiles.py — compare Qwen CPU inference profiles
+"""
+Loads Qwen3-0.6B once per QWEN_PROFILE (each in a fresh process, since
+thread counts and quantization are process-wide) and reports load time,
+decode throughput and resident memory.
+
+    cd backend
+    python benchmarks/qwen_profiles.py                       # all profiles
+    python benchmarks/qwen_profiles.py --profiles int8 bf16 --threads 4 --compile
+    python benchmarks/qwen_profiles.py --json results.json
+
+Throughput is output tokens per second of wall time for one request at a
+time (the micro-batcher is bypassed), averaged over --runs after one warm-up.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def _child(runs: int, max_new_tokens: int) -> dict:
+    import psutil
+
+    sys.path.insert(0, BACKEND_DIR)
+    import llm_qwen
+    from prompts import build_structured_prompt
+
+    prompt = build_structured_prompt("Sri Lanka", "3", "English", "Fractions")
+
+    proc = psutil.Process()
+    started = time.perf_counter()
+    llm_qwen.warmup()
+    load_s = time.perf_counter() - started
+    rss_loaded = proc.memory_info().rss
+
+    with llm_qwen._use_model() as (tokenizer, _):
+        def count(text):
+            return len(tokenizer(text).input_ids)
+
+    llm_qwen.generate_batch([prompt], max_new_tokens)  # warm-up (and compile, if enabled)
+
+    tokens = 0
+    elapsed = 0.0
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        text = llm_qwen.generate_batch([prompt], max_new_tokens)[0]
+        elapsed += time.perf_counter() - t0
+        tokens += count(text)
+
+    return {
+        "profile": llm_qwen.PROFILE,
+        "threads": llm_qwen.NUM_THREADS or None,
+        "compile": llm_qwen.COMPILE,
+        "load_s": round(load_s, 2),
+        "tokens_per_s": round(tokens / elapsed, 2) if elapsed else None,
+        "latency_s": round(elapsed / runs, 2),
+        "rss_loaded_mb": round(rss_loaded / 2**20),
+        # ru_maxrss is in KiB on Linux
+        "rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+    }
+
+
+def main():
+    sys.path.insert(0, BACKEND_DIR)
+    from llm_qwen import PROFILES
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    ap.add_argument("--threads", type=int, default=0, help="QWEN_NUM_THREADS (0 = torch default)")
+    ap.add_argument("--compile", action="store_true", help="set QWEN_COMPILE=1")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--max-new-tokens", type=int, default=128)
+    ap.add_argument("--json", metavar="PATH", help="also write the results here")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.runs, args.max_new_tokens)))
+        return
+
+    results = []
+    for profile in args.profiles:
+        env = dict(os.environ, QWEN_PROFILE=profile, QWEN_NUM_THREADS=str(args.threads),
+                   QWEN_COMPILE="1" if args.compile else "0")
+        cmd = [sys.executable, os.path.abspath(__file__), "--child",
+               "--runs", str(args.runs), "--max-new-tokens", str(args.max_new_tokens)]
+        print(f"profile {profile} ...", file=sys.stderr)
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            results.append({"profile": profile, "error": proc.stderr.strip().splitlines()[-1:]})
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    cols = ("profile", "load_s", "tokens_per_s", "latency_s", "rss_loaded_mb", "rss_peak_mb")
+    print("  ".join(f"{c:>13}" for c in cols))
+    for r in results:
+        if "error" in r:
+            print(f"{r['profile']:>13}  failed: {r['error']}")
+            continue
+        print("  ".join(f"{str(r[c]):>13}" for c in cols))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
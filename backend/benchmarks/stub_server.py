@@ -0,0 +1,79 @@
+# stub_server.py — run the API with deterministic fake LLM backends
+"""
+Starts app.py's Flask app with every LLM backend replaced by a fake that
+sleeps for a fixed latency and returns a fixed-size answer, so API
+benchmarks measure the web/DB tier rather than a model or a remote API.
+
+    python benchmarks/stub_server.py --port 8099 --latency-ms 50 --db /tmp/bench.db
+
+Used by api_load.py (which starts it for you); can also be run by hand.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+
+def _answer(prompt: str, chars: int) -> str:
+    # Same shape as a real answer (prompts.FORMAT_SECTIONS); deterministic per prompt
+    from prompts import FORMAT_SECTIONS
+    body = (f"Stub answer for {len(prompt)}-char prompt. " * 50)[:max(0, chars)]
+    parts = [f"**{title}:**\n{body if i == 0 else 'Not specified.'}" for i, (title, _) in enumerate(FORMAT_SECTIONS)]
+    return "\n\n".join(parts)
+
+
+def install_stubs(latency_ms: float, chars: int):
+    import llm_router
+
+    delay = latency_ms / 1000.0
+
+    def call_backend(mk, prompt, max_new_tokens, structured):
+        time.sleep(delay)
+        return _answer(prompt, chars)
+
+    async def acall_backend(mk, prompt, max_new_tokens, structured):
+        await asyncio.sleep(delay)
+        return _answer(prompt, chars)
+
+    def open_stream(mk, prompt, max_new_tokens, structured):
+        text = _answer(prompt, chars)
+        step = max(1, len(text) // 20)
+        for i in range(0, len(text), step):
+            time.sleep(delay / 20)
+            yield text[i:i + step]
+
+    llm_router._call_backend = call_backend
+    llm_router._acall_backend = acall_backend
+    llm_router._open_stream = open_stream
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="fake generation latency")
+    ap.add_argument("--chars", type=int, default=400, help="length of the fake problem text")
+    ap.add_argument("--db", help="SQLite file to use instead of backend/app.db (APP_DB_PATH)")
+    args = ap.parse_args()
+
+    if args.db:
+        os.environ["APP_DB_PATH"] = os.path.abspath(args.db)
+    # Keep benchmark runs away from the developer's caches and job workers
+    os.environ.setdefault("LLM_CACHE_MODELS", "")
+    os.environ.setdefault("JOB_WORKERS", "0")
+
+    from _common import BACKEND_DIR
+    os.chdir(BACKEND_DIR)
+    install_stubs(args.latency_ms, args.chars)
+    from app import app
+
+    print(f"stub server on http://{args.host}:{args.port} (fake latency {args.latency_ms:.0f} ms)", file=sys.stderr)
+    app.run(host=args.host, port=args.port, threaded=True, debug=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,334 @@
 # db.py — SQLite helpers + schema used by auth.py and app.py
+import base64
+import hashlib
 import json
-import os, sqlite3
+import atexit
+import logging
+import os, queue, re, sqlite3, threading, time
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from typing import Iterable, Optional
+from urllib.parse import quote
 from flask import g
 import uuid
 from openpyxl import load_workbook
 
-# DB file lives next to this module
-DB_PATH = os.path.join(os.path.dirname(__file__), "app.db")
+from metrics import DB_SECONDS, DB_WRITE_GROUP
+
+# DB file lives next to this module (APP_DB_PATH overrides, e.g. for benchmarks)
+DB_PATH = os.getenv("APP_DB_PATH") or os.path.join(os.path.dirname(__file__), "app.db")
+
+# Connection tuning (env): page cache per connection in KiB, memory-mapped
+# I/O size in bytes, and how many prepared statements each connection keeps.
+DB_CACHE_KB = int(os.getenv("DB_CACHE_KB", "16384"))
+DB_MMAP_BYTES = int(os.getenv("DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "256"))
 
 def _connect():
      # open SQLite with a small lock timeout + allow threaded use (Flask)
-    con = sqlite3.connect(DB_PATH, timeout=5.0, check_same_thread=False)
+    con = sqlite3.connect(DB_PATH, timeout=5.0, check_same_thread=False,
+                          cached_statements=DB_STATEMENT_CACHE)
     con.row_factory = sqlite3.Row
+    # Only takes effect on a brand-new file (it must precede WAL and the first
+    # table); lets the history reaper hand freed pages back to the OS
+    con.execute("PRAGMA auto_vacuum=INCREMENTAL;")
      # WAL = better concurrency; keep durability reasonable
     con.execute("PRAGMA journal_mode=WAL;")
     con.execute("PRAGMA synchronous=NORMAL;")
     # enforce foreign keys at the DB level
     con.execute("PRAGMA foreign_keys=ON;")
+    con.execute(f"PRAGMA cache_size=-{DB_CACHE_KB};")
+    con.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES};")
+    con.execute("PRAGMA temp_store=MEMORY;")
     return con
 
+
+class _ConnectionPool:
+    """
+    Long-lived connections shared by requests, so the per-request cost of
+    get_db() is a list pop instead of open + PRAGMAs, and each connection's
+    page cache and prepared statements survive between requests.
+
+    Up to `size` connections are kept open; under bursts up to `max_overflow`
+    more are opened and closed again on release. When even those are in use,
+    acquire() waits up to `timeout` seconds. A thread gets back the connection
+    it used last when that one is idle. Connections idle for more than
+    `check_after` seconds are verified with SELECT 1 before reuse.
+    """
+
+    def __init__(self, size: int, max_overflow: int, timeout: float, check_after: float):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.check_after = check_after
+        self._cond = threading.Condition()
+        self._idle: list = []  # [(connection, released_at)], most recent last
+        self._open = 0
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+    def _reset_after_fork(self):
+        # Connections must not be shared with a forked child; start over there
+        self._idle = []
+        self._open = 0
+        self._pid = os.getpid()
+
+    def _take_idle(self):
+        preferred = getattr(self._local, "con", None)
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._idle[i][0] is preferred:
+                return self._idle.pop(i)
+        return self._idle.pop()
+
+    def acquire(self) -> sqlite3.Connection:
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset_after_fork()
+            while True:
+                if self._idle:
+                    con, released_at = self._take_idle()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    self._open += 1
+                    con = released_at = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise sqlite3.OperationalError(
+                        f"no database connection available within {self.timeout:.0f}s")
+                self._cond.wait(remaining)
+
+        if con is not None and time.monotonic() - released_at > self.check_after:
+            try:
+                con.execute("SELECT 1").fetchone()
+            except sqlite3.Error:
+                self._discard(con)
+                con = None
+                with self._cond:
+                    self._open += 1
+        if con is None:
+            try:
+                con = _connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        self._local.con = con
+        return con
+
+    def release(self, con: sqlite3.Connection):
+        try:
+            if con.in_transaction:
+                con.rollback()  # never hand on a half-finished transaction
+        except sqlite3.Error:
+            self._discard(con)
+            return
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if len(self._idle) < self.size:
+                self._idle.append((con, time.monotonic()))
+                self._cond.notify()
+                return
+            self._open -= 1
+            self._cond.notify()
+        con.close()  # overflow connection
+
+    def _discard(self, con):
+        try:
+            con.close()
+        except sqlite3.Error:
+            pass
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"open": self._open, "idle": len(self._idle)}
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for con, _ in idle:
+            con.close()
+
+
+_pool = _ConnectionPool(
+    size=int(os.getenv("DB_POOL_SIZE", "8")),
+    max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "32")),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+    check_after=float(os.getenv("DB_POOL_CHECK_SECONDS", "30")),
+)
+
 def get_db():
-     # one connection per request, cached on Flask 'g'
+     # one pooled connection per request, cached on Flask 'g'
     if "db" not in g:
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True) # ensure folder
-        g.db = _connect()
+        g.db = _pool.acquire()
     return g.db
 
 def close_db(_exc=None):
-     # close at request teardown
+     # hand the connection back to the pool at request teardown
     db = g.pop("db", None)
-    if db: db.close()
+    if db: _pool.release(db)
+
+@contextmanager
+def pooled_connection():
+    """A pool connection for code that runs outside a request (or must not hold the request's)."""
+    con = _pool.acquire()
+    try:
+        yield con
+    finally:
+        _pool.release(con)
+
+def pool_stats() -> dict:
+    return _pool.stats()
+
+
+class _GroupWriter:
+    """
+    Single writer thread for the history tables (group commit).
+
+    Writers hand an operation `op(con)` to submit(); the thread takes whatever
+    is queued, waits up to `max_wait` seconds for more (at most `max_size`
+    ops), and runs the group in one BEGIN IMMEDIATE ... COMMIT, each op inside
+    its own SAVEPOINT so a failing op (e.g. PermissionError) is rolled back
+    and raised to its caller without affecting the others. Results are
+    delivered only after the COMMIT, so a caller that waits knows its write is
+    durable. With one writer, request threads never queue on SQLite's write
+    lock, and a burst costs one commit instead of one per request.
+    """
+
+    def __init__(self, max_size: int, max_wait: float, timeout: float):
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._pid = None
+
+    def _ensure_started(self) -> queue.Queue:
+        with self._lock:
+            if self._queue is None or self._pid != os.getpid():  # also after a fork
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(self._queue,),
+                                 name="db-writer", daemon=True).start()
+            return self._queue
+
+    def submit(self, op, wait: bool = True):
+        """Queue op(con); with wait=True block until committed and return its result."""
+        fut = Future()
+        self._ensure_started().put((op, fut))
+        if not wait:
+            fut.add_done_callback(_report_write_error)
+            return None
+        try:
+            return fut.result(timeout=self.timeout)
+        except FutureTimeout:
+            # Still queued: withdraw it, so a client retrying after the error
+            # does not end up writing twice. Already running: its group is
+            # about to commit, so wait for the real outcome instead.
+            if fut.cancel():
+                raise sqlite3.OperationalError(
+                    f"write not committed within {self.timeout:g}s") from None
+            return fut.result()
+
+    def flush(self):
+        """Wait until everything queued so far is committed (no-op if never used)."""
+        if self._queue is not None and self._pid == os.getpid():
+            self.submit(lambda con: None)
+
+    def _collect(self, jobs: queue.Queue) -> list:
+        batch = [jobs.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(jobs.get(timeout=remaining) if remaining > 0 else jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, jobs: queue.Queue):
+        con = None
+        while True:
+            batch = self._collect(jobs)
+            try:
+                if con is None:
+                    con = _connect()
+                    con.isolation_level = None  # transactions are managed here
+                self._commit_group(con, batch)
+            except Exception as e:
+                # Connection-level failure: fail the whole group, reconnect next time
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                try:
+                    con.close()
+                except Exception:
+                    pass
+                con = None
+
+    def _commit_group(self, con, batch: list):
+        DB_WRITE_GROUP.observe(len(batch))
+        done = []
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            for op, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                con.execute("SAVEPOINT op")
+                try:
+                    value = op(con)
+                except Exception as e:
+                    con.execute("ROLLBACK TO op")
+                    con.execute("RELEASE op")
+                    done.append((fut, None, e))
+                else:
+                    con.execute("RELEASE op")
+                    done.append((fut, value, None))
+            con.execute("COMMIT")
+        except BaseException:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        for fut, value, error in done:
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(value)
+
+
+def _report_write_error(fut: Future):
+    # Fire-and-forget writes have no caller left to raise to
+    if not fut.cancelled() and fut.exception() is not None:
+        print("db writer: write failed:", fut.exception())
+
+
+GROUP_COMMIT = os.getenv("DB_GROUP_COMMIT", "1") != "0"
+_writer = _GroupWriter(
+    max_size=int(os.getenv("DB_WRITE_BATCH_MAX", "64")),
+    max_wait=float(os.getenv("DB_WRITE_BATCH_MS", "2")) / 1000.0,
+    timeout=float(os.getenv("DB_WRITE_TIMEOUT", "30")),
+)
+atexit.register(_writer.flush)
+
+def _write(op, wait: bool = True):
+    """Run op(con) through the group-commit writer (or directly when DB_GROUP_COMMIT=0)."""
+    if GROUP_COMMIT:
+        return _writer.submit(op, wait=wait)
+    db = get_db()
+    with db:
+        return op(db)
 
 def init_db():
      # create tables/indexes if missing
-     # created a table learning_objectives for the data collected from the excel sheet
+     # (the learning objectives from the excel sheet live in CURRICULUM_DB_PATH)
     db = _connect()
     db.executescript("""
     CREATE TABLE IF NOT EXISTS users(
@@ -42,7 +336,8 @@ def init_db():
       email TEXT UNIQUE NOT NULL,
       username TEXT UNIQUE NOT NULL,
       password_hash TEXT NOT NULL,
-      created_at TEXT DEFAULT CURRENT_TIMESTAMP
+      created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+      history_epoch INTEGER NOT NULL DEFAULT 0
     );
     CREATE TABLE IF NOT EXISTS qa_pairs(
       qaid TEXT PRIMARY KEY,
@@ -55,23 +350,34 @@ def init_db():
       review_score INTEGER,
       review_text  TEXT,
       review_at    TEXT,
+      epoch        INTEGER NOT NULL DEFAULT 0,
       FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
     );
-    CREATE INDEX IF NOT EXISTS idx_qa_user_created
-      ON qa_pairs(user_id, created_at DESC);
-    CREATE TABLE IF NOT EXISTS learning_objectives (
-      id INTEGER PRIMARY KEY AUTOINCREMENT,
-      country TEXT NOT NULL,
-      grade   TEXT NOT NULL,
-      language TEXT NOT NULL,
-      topic    TEXT NOT NULL,
-      objective TEXT NOT NULL,
-      UNIQUE(country, grade, language, topic, objective)
+    CREATE TABLE IF NOT EXISTS jobs(
+      id TEXT PRIMARY KEY,
+      user_id INTEGER NOT NULL,
+      status TEXT NOT NULL,
+      payload_json TEXT NOT NULL,
+      result_json TEXT,
+      error TEXT,
+      attempts INTEGER NOT NULL DEFAULT 0,
+      created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+      started_at TEXT,
+      heartbeat_at TEXT,
+      finished_at TEXT,
+      qaid TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status
+      ON jobs(status);
+    CREATE TABLE IF NOT EXISTS pending_purges(
+      user_id INTEGER PRIMARY KEY,
+      below_epoch INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS leases(
+      name TEXT PRIMARY KEY,
+      owner TEXT NOT NULL,
+      lease_until REAL NOT NULL
     );
-    CREATE INDEX IF NOT EXISTS idx_lo_cgl 
-      ON learning_objectives(country, grade, language);
-    CREATE INDEX IF NOT EXISTS idx_lo_cglt 
-      ON learning_objectives(country, grade, language, topic);
     """)
     # Backfill columns that might be missing if the DB was created before
     # review fields were introduced. CREATE TABLE IF NOT EXISTS will not
@@ -84,13 +390,92 @@ def init_db():
             db.execute("ALTER TABLE qa_pairs ADD COLUMN review_text TEXT")
         if "review_at" not in cols:
             db.execute("ALTER TABLE qa_pairs ADD COLUMN review_at TEXT")
+        if "epoch" not in cols:
+            db.execute("ALTER TABLE qa_pairs ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0")
+        user_cols = [r[1] for r in db.execute("PRAGMA table_info(users)").fetchall()]
+        if "history_epoch" not in user_cols:
+            db.execute("ALTER TABLE users ADD COLUMN history_epoch INTEGER NOT NULL DEFAULT 0")
+        job_cols = [r[1] for r in db.execute("PRAGMA table_info(jobs)").fetchall()]
+        if "heartbeat_at" not in job_cols:
+            db.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at TEXT")
+        if "qaid" not in job_cols:
+            db.execute("ALTER TABLE jobs ADD COLUMN qaid TEXT")
     except Exception:
         # In case the table doesn't exist yet the CREATE above will handle it.
         pass
+    # History reads filter on the user's live epoch (see delete_all_qa_for_user)
+    # Ascending on purpose: walked backwards it yields created_at DESC, rowid DESC
+    # (rowid is the index's implicit last key), the order every history query uses
+    db.execute("CREATE INDEX IF NOT EXISTS idx_qa_user_epoch_time ON qa_pairs(user_id, epoch, created_at)")
+    db.execute("DROP INDEX IF EXISTS idx_qa_user_epoch_created")
+    db.execute("DROP INDEX IF EXISTS idx_qa_user_created")
+    _init_history_fts(db)
     db.commit()
     db.close()
 
+_QA_FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+      question, answer, topic, learning_objective,
+      user_id,
+      tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS qa_fts_ai AFTER INSERT ON qa_pairs BEGIN
+      INSERT INTO qa_fts(rowid, question, answer, topic, learning_objective, user_id)
+      VALUES (new.rowid, new.question, new.answer,
+              CASE WHEN json_valid(new.meta_json) THEN json_extract(new.meta_json, '$.topic') END,
+              CASE WHEN json_valid(new.meta_json) THEN json_extract(new.meta_json, '$.learning_objective') END,
+              new.user_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS qa_fts_ad AFTER DELETE ON qa_pairs BEGIN
+      DELETE FROM qa_fts WHERE rowid = old.rowid;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS qa_fts_au AFTER UPDATE OF question, answer, meta_json ON qa_pairs BEGIN
+      UPDATE qa_fts SET
+        question = new.question,
+        answer = new.answer,
+        topic = CASE WHEN json_valid(new.meta_json) THEN json_extract(new.meta_json, '$.topic') END,
+        learning_objective = CASE WHEN json_valid(new.meta_json) THEN json_extract(new.meta_json, '$.learning_objective') END
+      WHERE rowid = old.rowid;
+    END""",
+)
+
+def _init_history_fts(db):
+    # Full-text index over saved history (question, answer, topic, LO).
+    # Rows share qa_pairs' rowid and are kept in sync by triggers. user_id is
+    # an indexed column too, so a search ANDs the owner into the MATCH and
+    # FTS5 only walks that user's postings (see search_qa_for_user).
+    # Check, (re)build and backfill in one write transaction: a crash part
+    # way leaves the old index in place to be rebuilt on the next start, and
+    # a second process starting at the same time sees the finished table.
+    db.commit()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        existed = db.execute(
+            "SELECT sql FROM sqlite_master WHERE type='table' AND name='qa_fts'"
+        ).fetchone()
+        if existed and "UNINDEXED" in existed[0]:
+            # Older layout kept user_id out of the index: rebuild it
+            db.execute("DROP TABLE qa_fts")
+            existed = None
+        for ddl in _QA_FTS_DDL:
+            db.execute(ddl)
+        if not existed:
+            # First run (or rebuild) on an existing database: index the history saved so far
+            db.execute("""
+            INSERT INTO qa_fts(rowid, question, answer, topic, learning_objective, user_id)
+            SELECT rowid, question, answer,
+                   CASE WHEN json_valid(meta_json) THEN json_extract(meta_json, '$.topic') END,
+                   CASE WHEN json_valid(meta_json) THEN json_extract(meta_json, '$.learning_objective') END,
+                   user_id
+            FROM qa_pairs
+            """)
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+
 # --- functions expected by auth.py ---
+@DB_SECONDS.timed(op="create_user")
 def create_user(email, username, password_hash):
     # insert user; returns new integer id
     db = get_db()
@@ -101,6 +486,7 @@ def create_user(email, username, password_hash):
     db.commit()
     return cur.lastrowid
 
+@DB_SECONDS.timed(op="get_user_by_email")
 def get_user_by_email(email):
         # fetch single user by email
     return get_db().execute(
@@ -108,6 +494,7 @@ def get_user_by_email(email):
         (email,)
     ).fetchone()
 
+@DB_SECONDS.timed(op="get_user_by_username")
 def get_user_by_username(username):
     # fetch single user by username
     return get_db().execute(
@@ -115,6 +502,7 @@ def get_user_by_username(username):
         (username,)
     ).fetchone()
 
+@DB_SECONDS.timed(op="get_user_by_id")
 def get_user_by_id(uid):
         # fetch single user by id
     return get_db().execute(
@@ -124,31 +512,201 @@ def get_user_by_id(uid):
 
 #Helper functions used by /generate
 
-def save_qa(user_id: int, question: str, answer: str, model: str, meta: dict | None = None) -> str:
+# New rows belong to the user's live history epoch
+_INSERT_QA = """
+INSERT INTO qa_pairs (qaid, user_id, question, answer, model, meta_json, epoch)
+VALUES (?,?,?,?,?,?, COALESCE((SELECT history_epoch FROM users WHERE id=?), 0))
+"""
+
+@DB_SECONDS.timed(op="save_qa")
+def save_qa(user_id: int, question: str, answer: str, model: str, meta: dict | None = None,
+            wait: bool = True, job_id: Optional[str] = None) -> str:
+    """
+    Insert one Q/A and return its qaid; wait=False returns before the group commit.
+    With job_id (an async job's answer) the qaid is recorded on the job in the
+    same transaction, and a job that already has one saves nothing and gets
+    that qaid back, so a retried job never adds a second history row.
+    """
     qaid = str(uuid.uuid4())
-    db = get_db()
-    db.execute(
-        "INSERT INTO qa_pairs (qaid, user_id, question, answer, model, meta_json) VALUES (?,?,?,?,?,?)",
-        (qaid, user_id, question, answer, model, json.dumps(meta or {})),
-    )
-    db.commit()
-    return qaid
+    row = (qaid, user_id, question, answer, model, json.dumps(meta or {}), user_id)
+    if job_id is None:
+        _write(lambda con: con.execute(_INSERT_QA, row), wait=wait)
+        return qaid
+
+    def op(con):
+        saved = con.execute("SELECT qaid FROM jobs WHERE id=?", (job_id,)).fetchone()
+        if saved and saved[0]:
+            return saved[0]
+        con.execute(_INSERT_QA, row)
+        con.execute("UPDATE jobs SET qaid=? WHERE id=?", (qaid, job_id))
+        return qaid
 
+    return _write(op, wait=wait) or qaid
 
 
+
+@DB_SECONDS.timed(op="save_qa_many")
+def save_qa_many(user_id: int, items: list[tuple[str, str, str, dict | None]]) -> list[str]:
+    """Save several (question, answer, model, meta) rows in one transaction; returns their qaids."""
+    qaids = [str(uuid.uuid4()) for _ in items]
+    rows = [
+        (qaid, user_id, question, answer, model, json.dumps(meta or {}), user_id)
+        for qaid, (question, answer, model, meta) in zip(qaids, items)
+    ]
+    _write(lambda con: con.executemany(_INSERT_QA, rows))
+    return qaids
+
+
+@DB_SECONDS.timed(op="list_qa_for_user")
 def list_qa_for_user(user_id: int, limit: int = 20, offset: int = 0):
+    # created_at is stored as 'YYYY-MM-DD HH:MM:SS', so it sorts correctly as text;
+    # ordering on the bare column (rowid breaks ties, newest first) walks
+    # idx_qa_user_epoch_time backwards instead of sorting every row of the user.
     return get_db().execute(
         """
         SELECT qaid, question, answer, model, meta_json, created_at,
                review_score, review_text, review_at
         FROM qa_pairs
-        WHERE user_id=?
-        ORDER BY datetime(created_at) DESC
+        WHERE user_id=? AND epoch=(SELECT history_epoch FROM users WHERE id=?)
+        ORDER BY created_at DESC, rowid DESC
         LIMIT ? OFFSET ?
         """,
-        (user_id, limit, offset),
+        (user_id, user_id, limit, offset),
     ).fetchall()
 
+def iter_qa_for_user(user_id: int, chunk_size: int = 500) -> Iterable[list]:
+    """
+    All of the user's Q/A rows in /history order (newest first), yielded in
+    lists of up to chunk_size, so exports never hold the whole history in
+    memory. Each chunk is its own short keyset query (like list_qa_page):
+    a slow download never pins one read snapshot, which would stop WAL
+    checkpoints from getting past it.
+    """
+    sql = """
+        SELECT qaid, question, answer, model, meta_json, created_at,
+               review_score, review_text, review_at, rowid
+        FROM qa_pairs
+        WHERE user_id=:uid AND epoch=(SELECT history_epoch FROM users WHERE id=:uid)
+          {after}
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT :n
+    """
+    params = {"uid": user_id, "n": chunk_size}
+    after = ""
+    while True:
+        rows = get_db().execute(sql.format(after=after), params).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        after = "AND created_at <= :ts AND (created_at < :ts OR rowid < :rid)"
+        params.update(ts=rows[-1]["created_at"], rid=rows[-1]["rowid"])
+
+def _encode_cursor(created_at: str, rowid: int) -> str:
+    raw = json.dumps([created_at, rowid]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, rowid = json.loads(raw)
+        return str(created_at), int(rowid)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+@DB_SECONDS.timed(op="list_qa_page")
+def list_qa_page(user_id: int, limit: int = 20, before: Optional[str] = None):
+    """
+    Keyset pagination over a user's history, newest first.
+    Pass the previous page's next_cursor as `before`; each page is an index
+    range scan no matter how deep it is. Returns (rows, next_cursor), where
+    next_cursor is None on the last page. Raises ValueError on a bad cursor.
+    """
+    cols = """qaid, question, answer, model, meta_json, created_at,
+               review_score, review_text, review_at, rowid"""
+    if before:
+        created_at, rowid = _decode_cursor(before)
+        rows = get_db().execute(
+            f"""
+            SELECT {cols}
+            FROM qa_pairs
+            WHERE user_id=:uid AND epoch=(SELECT history_epoch FROM users WHERE id=:uid)
+              AND created_at <= :ts AND (created_at < :ts OR rowid < :rid)
+            ORDER BY created_at DESC, rowid DESC
+            LIMIT :n
+            """,
+            {"uid": user_id, "ts": created_at, "rid": rowid, "n": limit + 1},
+        ).fetchall()
+    else:
+        rows = get_db().execute(
+            f"""
+            SELECT {cols}
+            FROM qa_pairs
+            WHERE user_id=? AND epoch=(SELECT history_epoch FROM users WHERE id=?)
+            ORDER BY created_at DESC, rowid DESC
+            LIMIT ?
+            """,
+            (user_id, user_id, limit + 1),
+        ).fetchall()
+
+    # One extra row tells us whether another page exists
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, _encode_cursor(last["created_at"], last["rowid"])
+
+def _fts_query(text: str) -> str:
+    """
+    Turn free user input into a safe FTS5 query: every word must match
+    (quoted, so FTS operators in the input are inert) and the last word also
+    matches as a prefix, which suits search-as-you-type.
+    """
+    words = re.findall(r"\w+", text or "")[:16]
+    if not words:
+        return ""
+    terms = ['"' + w.replace('"', '""') + '"' for w in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+def _user_fts_query(user_id: int, text: str) -> str:
+    """
+    _fts_query(text) limited to the text columns and to one user's rows.
+    The owner is part of the MATCH itself, so FTS5 intersects the words'
+    postings with that user's instead of ranking every user's hits.
+    """
+    match = _fts_query(text)
+    if not match:
+        return ""
+    return f'user_id : "{int(user_id)}" AND {{question answer topic learning_objective}} : ({match})'
+
+_SEARCH_QA_SQL = """
+    SELECT q.qaid, q.question, q.answer, q.model, q.meta_json, q.created_at,
+           q.review_score, q.review_text, q.review_at,
+           snippet(qa_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet
+    FROM qa_fts
+    JOIN qa_pairs q ON q.rowid = qa_fts.rowid
+    WHERE qa_fts MATCH ?
+      AND q.epoch = (SELECT history_epoch FROM users WHERE id = ?)
+    -- question/topic/LO hits weigh more than hits in the long answer
+    ORDER BY bm25(qa_fts, 2.0, 1.0, 1.5, 1.5, 0.0)
+    LIMIT ?
+"""
+
+@DB_SECONDS.timed(op="search_qa_for_user")
+def search_qa_for_user(user_id: int, query: str, limit: int = 20):
+    """
+    Full-text search over the user's saved history, best matches first.
+    Each row carries a `snippet` of the best-matching field with hits wrapped
+    in <mark>...</mark>.
+    """
+    match = _user_fts_query(user_id, query)
+    if not match:
+        return []
+    return get_db().execute(_SEARCH_QA_SQL, (match, user_id, limit)).fetchall()
+
+@DB_SECONDS.timed(op="get_qa")
 def get_qa(qaid: str, user_id: int) -> Optional[sqlite3.Row]:
     #Fetch a single questions and answers item by its id, scoped to the owner.
     return (
@@ -157,27 +715,227 @@ def get_qa(qaid: str, user_id: int) -> Optional[sqlite3.Row]:
             """
             SELECT qaid, user_id, question, answer, model, created_at
             FROM qa_pairs
-            WHERE qaid=? AND user_id=?
+            WHERE qaid=? AND user_id=? AND epoch=(SELECT history_epoch FROM users WHERE id=?)
             """,
-            (qaid, user_id),
+            (qaid, user_id, user_id),
         )
         .fetchone()
     )
 
-def delete_all_qa_for_user(user_id: int) -> int:
-    """Deletes all history of the user"""
-    db = get_db()
-    cur = db.execute("DELETE FROM qa_pairs WHERE user_id=?", (user_id,))
-    db.commit()
-    return cur.rowcount
+@DB_SECONDS.timed(op="delete_all_qa_for_user")
+def delete_all_qa_for_user(user_id: int) -> None:
+    """
+    Deletes all history of the user.
+    Only bumps users.history_epoch: every history read filters on the live
+    epoch, so the old rows disappear at once, and the history reaper deletes
+    them later in small batches instead of one long write-locked DELETE.
+    """
+    def op(con):
+        con.execute("UPDATE users SET history_epoch = history_epoch + 1 WHERE id=?", (user_id,))
+        con.execute(
+            """INSERT INTO pending_purges(user_id, below_epoch)
+               SELECT id, history_epoch FROM users WHERE id=?
+               ON CONFLICT(user_id) DO UPDATE SET below_epoch=excluded.below_epoch""",
+            (user_id,),
+        )
+
+    _write(op)
+    _purge_wakeup.set()
+
+# --------- History reaper ----------
+# Background thread deleting cleared history (rows below a user's live epoch)
+# PURGE_BATCH_ROWS at a time, pausing PURGE_PAUSE_MS between batches so other
+# writers get the lock in between, then returning the freed pages to the OS
+# with incremental vacuum. A database created before auto_vacuum=INCREMENTAL
+# was set is converted by the reaper with one full VACUUM the first time it
+# has free pages (writers wait for it to finish; see the log).
+# Every process starts the thread, but only the holder of the
+# 'history-reaper' lease does any work; the others take over once it has
+# gone DB_REAPER_LEASE_SECONDS without renewing (e.g. its process died).
 
+PURGE_BATCH_ROWS = int(os.getenv("DB_PURGE_BATCH_ROWS", "500"))
+PURGE_PAUSE_MS = float(os.getenv("DB_PURGE_PAUSE_MS", "50"))
+VACUUM_PAGES = int(os.getenv("DB_VACUUM_PAGES", "512"))
+REAPER_LEASE_SECONDS = float(os.getenv("DB_REAPER_LEASE_SECONDS", "120"))
+# Idle reapers look again this often; shorter than the lease so the holder keeps it
+_REAPER_POLL_SECONDS = min(60.0, REAPER_LEASE_SECONDS / 2)
+
+log = logging.getLogger(__name__)
+
+_purge_wakeup = threading.Event()
+_reaper_lock = threading.Lock()
+_reaper_pid = None
+
+def _hold_lease(con, name: str, owner: str, seconds: float) -> bool:
+    """Take or renew the named lease for owner; False while someone else holds it."""
+    now = time.time()
+    with con:
+        return con.execute(
+            """INSERT INTO leases(name, owner, lease_until) VALUES (:name, :owner, :until)
+               ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, lease_until=excluded.lease_until
+               WHERE leases.owner = excluded.owner OR leases.lease_until < :now""",
+            {"name": name, "owner": owner, "until": now + seconds, "now": now},
+        ).rowcount == 1
+
+def _purge_step(con) -> bool:
+    """Delete one batch of cleared history; False when there is nothing left to delete."""
+    job = con.execute("SELECT user_id, below_epoch FROM pending_purges ORDER BY rowid LIMIT 1").fetchone()
+    if job is None:
+        return False
+    with con:
+        deleted = con.execute(
+            """DELETE FROM qa_pairs WHERE rowid IN (
+                 SELECT rowid FROM qa_pairs WHERE user_id=? AND epoch<? LIMIT ?)""",
+            (job["user_id"], job["below_epoch"], PURGE_BATCH_ROWS),
+        ).rowcount
+        if deleted < PURGE_BATCH_ROWS:
+            # A newer clear may have raised below_epoch meanwhile; keep that one
+            con.execute(
+                "DELETE FROM pending_purges WHERE user_id=? AND below_epoch=?",
+                (job["user_id"], job["below_epoch"]),
+            )
+    return True
+
+def _vacuum_step(con) -> bool:
+    """Release up to VACUUM_PAGES free pages; False when there is nothing to release."""
+    free = con.execute("PRAGMA freelist_count").fetchone()[0]
+    if not free:
+        return False
+    mode = con.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode == 0:  # NONE: the setting in _connect() only applies to new files
+        log.warning("history reaper: converting %s to auto_vacuum=INCREMENTAL "
+                    "(one-time VACUUM, %d free pages); writes wait until it finishes",
+                    DB_PATH, free)
+        started = time.monotonic()
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        con.execute("VACUUM")
+        log.warning("history reaper: VACUUM finished in %.1fs", time.monotonic() - started)
+        return True
+    if mode != 2:  # 2 = INCREMENTAL; 1 = FULL frees pages on every commit
+        return False
+    con.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()  # runs one page per step
+    return True
+
+def _reap_history(owner: str):
+    con = None
+    while True:
+        _purge_wakeup.clear()
+        try:
+            if con is None:
+                con = _connect()
+            # Renewed before every step, so the lease never lapses mid-purge
+            while (_hold_lease(con, "history-reaper", owner, REAPER_LEASE_SECONDS)
+                   and (_purge_step(con) or _vacuum_step(con))):
+                time.sleep(PURGE_PAUSE_MS / 1000.0)
+        except sqlite3.Error as e:
+            log.warning("history reaper: %s", e)
+            try:
+                con.close()
+            except Exception:
+                pass
+            con = None
+        _purge_wakeup.wait(_REAPER_POLL_SECONDS)
+
+def start_history_reaper():
+    """Start the reaper thread (once per process); it also resumes purges left from a restart."""
+    global _reaper_pid
+    with _reaper_lock:
+        if _reaper_pid == os.getpid():
+            return
+        _reaper_pid = os.getpid()
+        # pid plus a random part: a restarted process may get the pid of a dead one
+        owner = f"{_reaper_pid}-{uuid.uuid4().hex[:8]}"
+        threading.Thread(target=_reap_history, args=(owner,), name="history-reaper", daemon=True).start()
+
+@DB_SECONDS.timed(op="delete_qa")
 def delete_qa(qaid: str, user_id: int) -> int:
     """Delete a single Q/A by id for the owner. Returns rows deleted (0 or 1)."""
-    db = get_db()
-    cur = db.execute("DELETE FROM qa_pairs WHERE qaid=? AND user_id=?", (qaid, user_id))
-    db.commit()
-    return cur.rowcount
+    return _write(
+        lambda con: con.execute(
+            "DELETE FROM qa_pairs WHERE qaid=? AND user_id=? AND epoch=(SELECT history_epoch FROM users WHERE id=?)",
+            (qaid, user_id, user_id),
+        ).rowcount
+    )
+
+
+# --------- Curriculum database ----------
+# The learning objectives live in their own SQLite file, separate from the
+# user data in app.db. The importer never modifies it in place: it builds a
+# new file next to it and os.replace()s it over the old one, so readers can
+# open it with immutable=1 (no locks, no WAL, pages read through mmap) and a
+# reader that still has the old file open keeps a consistent snapshot.
+
+CURRICULUM_DB_PATH = os.getenv("CURRICULUM_DB_PATH") or os.path.join(os.path.dirname(DB_PATH), "curriculum.db")
+CURRICULUM_MMAP_BYTES = int(os.getenv("CURRICULUM_MMAP_BYTES", str(64 * 1024 * 1024)))
+
+_CURRICULUM_SCHEMA = """
+CREATE TABLE IF NOT EXISTS learning_objectives (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  country TEXT NOT NULL,
+  grade   TEXT NOT NULL,
+  language TEXT NOT NULL,
+  topic    TEXT NOT NULL,
+  objective TEXT NOT NULL,
+  UNIQUE(country, grade, language, topic, objective)
+);
+CREATE INDEX IF NOT EXISTS idx_lo_cgl
+  ON learning_objectives(country, grade, language);
+CREATE INDEX IF NOT EXISTS idx_lo_cglt
+  ON learning_objectives(country, grade, language, topic);
+CREATE TABLE IF NOT EXISTS import_state(
+  source TEXT PRIMARY KEY,
+  sha256 TEXT NOT NULL,
+  mtime  REAL NOT NULL,
+  size   INTEGER NOT NULL,
+  rows   INTEGER NOT NULL,
+  imported_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
 
+def _curriculum_file_id() -> Optional[tuple]:
+    # Changes whenever a new curriculum file is swapped in (by any process)
+    try:
+        st = os.stat(CURRICULUM_DB_PATH)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _curriculum_connect() -> Optional[sqlite3.Connection]:
+    """Read-only connection to the current curriculum file, or None before the first import."""
+    if not os.path.exists(CURRICULUM_DB_PATH):
+        return None
+    uri = "file:" + quote(os.path.abspath(CURRICULUM_DB_PATH)) + "?mode=ro&immutable=1"
+    con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    con.row_factory = sqlite3.Row
+    con.execute(f"PRAGMA mmap_size={CURRICULUM_MMAP_BYTES};")
+    return con
+
+def _rebuild_curriculum(change) -> None:
+    """
+    Copy the current curriculum file, apply change(con) to the copy in one
+    transaction and atomically swap the copy in.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(CURRICULUM_DB_PATH)), exist_ok=True)
+    tmp = f"{CURRICULUM_DB_PATH}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        con = sqlite3.connect(tmp)
+        con.row_factory = sqlite3.Row
+        try:
+            current = _curriculum_connect()
+            if current is not None:
+                current.backup(con)
+                current.close()
+            # Rollback journal, not WAL: the finished file must be a single self-contained file
+            con.execute("PRAGMA journal_mode=DELETE;")
+            con.executescript(_CURRICULUM_SCHEMA)
+            with con:
+                change(con)
+        finally:
+            con.close()
+        os.replace(tmp, CURRICULUM_DB_PATH)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
 # --------- Data from the excel file importer and utilities ----------
 
@@ -186,18 +944,53 @@ def _canon(s: str) -> str:
     """Trim/normalize a cell value into a safe string."""
     return (s or "").strip()
 
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
 #Reads the excel file, cleans each row and saves all learning objectives to the database 
-def import_learning_objectives_xlsx(xlsx_path: str) -> int:
+@DB_SECONDS.timed(op="import_learning_objectives_xlsx")
+def import_learning_objectives_xlsx(xlsx_path: str, replace: bool = False, force: bool = False) -> int:
     """
-    Load/refresh learning objectives from an Excel file into SQLite.
+    Load/refresh learning objectives from an Excel file into the curriculum DB.
     This is idempotent: duplicates are ignored via UNIQUE constraint.
-    Returns the number of rows processed (attempted).
+    The workbook's size/mtime and SHA-256 are recorded in import_state; when
+    they match the last import the file is not parsed at all (unless force).
+    With replace=True, objectives no longer present in the sheet are deleted.
+    Returns the number of rows processed (attempted), or 0 when skipped.
     Expected columns (case-insensitive):
       Country | Grade | Language | Topic | Learning Objective
     """
     if not os.path.exists(xlsx_path):
         raise FileNotFoundError(f"LO spreadsheet not found: {xlsx_path}")
 
+    source = os.path.abspath(xlsx_path)
+    st = os.stat(xlsx_path)
+    prev = None
+    current = _curriculum_connect()
+    if current is not None:
+        prev = current.execute(
+            "SELECT sha256, mtime, size FROM import_state WHERE source=?", (source,)
+        ).fetchone()
+        current.close()
+
+    # Cheap check first: same size and mtime means the same file
+    if not force and prev and prev["mtime"] == st.st_mtime and prev["size"] == st.st_size:
+        return 0
+
+    digest = _file_sha256(xlsx_path)
+    if not force and prev and prev["sha256"] == digest:
+        # Touched but identical content: remember the new mtime and skip
+        _rebuild_curriculum(lambda db: db.execute(
+            "UPDATE import_state SET mtime=?, size=? WHERE source=?",
+            (st.st_mtime, st.st_size, source),
+        ))
+        _invalidate_lo_index()
+        return 0
+
     wb = load_workbook(filename=xlsx_path, read_only=True, data_only=True)
     ws = wb.active
 
@@ -219,8 +1012,7 @@ def import_learning_objectives_xlsx(xlsx_path: str) -> int:
     i_topic   = headers.index("topic")
     i_obj     = headers.index("learning objective")
 
-    db = get_db()
-    n = 0
+    rows = []
     for row in ws.iter_rows(min_row=2):
         country = _canon(row[i_country].value)
         grade   = _canon(str(row[i_grade].value))
@@ -231,102 +1023,181 @@ def import_learning_objectives_xlsx(xlsx_path: str) -> int:
         # Skip incomplete rows
         if not (country and grade and lang and topic and obj):
             continue
+        rows.append((country, grade, lang, topic, obj))
+    wb.close()
 
+    # One transaction for the whole sheet, on a copy that is then swapped in
+    def change(db):
         # Insert or ignore duplicates
-        db.execute(
+        db.executemany(
             """INSERT OR IGNORE INTO learning_objectives
                (country, grade, language, topic, objective)
                VALUES (?,?,?,?,?)""",
-            (country, grade, lang, topic, obj),
+            rows,
+        )
+        if replace:
+            # Drop objectives that were removed from the sheet
+            keep = set(rows)
+            stale = [
+                (r["id"],) for r in db.execute(
+                    "SELECT id, country, grade, language, topic, objective FROM learning_objectives"
+                ).fetchall()
+                if tuple(r)[1:] not in keep
+            ]
+            db.executemany("DELETE FROM learning_objectives WHERE id=?", stale)
+        db.execute(
+            """INSERT INTO import_state(source, sha256, mtime, size, rows, imported_at)
+               VALUES (?,?,?,?,?,CURRENT_TIMESTAMP)
+               ON CONFLICT(source) DO UPDATE SET
+                 sha256=excluded.sha256, mtime=excluded.mtime, size=excluded.size,
+                 rows=excluded.rows, imported_at=excluded.imported_at""",
+            (source, digest, st.st_mtime, st.st_size, len(rows)),
         )
-        n += 1
 
-    db.commit()
-    return n
+    _rebuild_curriculum(change)
+    _invalidate_lo_index()
+    return len(rows)
+
+# --------- In-memory curriculum index ----------
+# The learning_objectives table only changes on import, so the dropdown
+# helpers below are served from a nested dict built once from a single
+# SELECT (country -> grade -> language -> topic -> objectives) instead of
+# querying SQLite on every request. It is rebuilt when the curriculum file
+# changes, including re-imports done by other worker processes.
+
+def _nocase(s: str) -> str:
+    # Mirrors SQLite's COLLATE NOCASE ordering
+    return s.lower()
+
+def _grade_key(grade: str) -> tuple:
+    # Mirrors ORDER BY CAST(grade AS INTEGER): leading integer, else 0
+    m = re.match(r"\s*([+-]?\d+)", grade)
+    return (int(m.group(1)) if m else 0, grade)
+
+class _CurriculumIndex:
+    def __init__(self, rows, file_id: Optional[tuple] = None):
+        self.file_id = file_id  # _curriculum_file_id() of the file the rows came from
+        self.tree: dict = {}
+        languages: dict = {}
+        grades: dict = {}
+        for country, grade, language, topic, objective in rows:
+            (self.tree.setdefault(country, {})
+                      .setdefault(grade, {})
+                      .setdefault(language, {})
+                      .setdefault(topic, set())
+                      .add(objective))
+            # Every filter combination the list_distinct_* helpers accept
+            for key in ((None, None), (country, None), (None, grade), (country, grade)):
+                languages.setdefault(key, set()).add(language)
+            for key in ((None, None), (country, None), (None, language), (country, language)):
+                grades.setdefault(key, set()).add(grade)
+
+        self.countries = sorted(self.tree, key=_nocase)
+        self.languages = {k: sorted(v, key=_nocase) for k, v in languages.items()}
+        self.grades = {k: sorted(v, key=_grade_key) for k, v in grades.items()}
+        self.topics = {}
+        self.objectives = {}
+        for country, by_grade in self.tree.items():
+            for grade, by_lang in by_grade.items():
+                for language, by_topic in by_lang.items():
+                    self.topics[(country, grade, language)] = sorted(by_topic, key=_nocase)
+                    for topic, objs in by_topic.items():
+                        self.objectives[(country, grade, language, topic)] = sorted(objs, key=_nocase)
+
+        # Content fingerprint, used as the ETag of the /options/* responses
+        digest = hashlib.sha1()
+        for row in sorted(rows):
+            digest.update("\x1f".join(row).encode("utf-8"))
+            digest.update(b"\x1e")
+        self.version = digest.hexdigest()
+
+_lo_index: Optional[_CurriculumIndex] = None
+_lo_index_lock = threading.Lock()
+
+def _get_lo_index() -> _CurriculumIndex:
+    global _lo_index
+    file_id = _curriculum_file_id()
+    idx = _lo_index
+    # Rebuilt when another process (or this one) has swapped in a new file
+    if idx is None or idx.file_id != file_id:
+        with _lo_index_lock:
+            if _lo_index is None or _lo_index.file_id != file_id:
+                rows = []
+                con = _curriculum_connect()
+                if con is not None:
+                    rows = [tuple(r) for r in con.execute(
+                        "SELECT country, grade, language, topic, objective FROM learning_objectives"
+                    ).fetchall()]
+                    con.close()
+                _lo_index = _CurriculumIndex(rows, file_id)
+            idx = _lo_index
+    return idx
+
+def _invalidate_lo_index():
+    global _lo_index
+    with _lo_index_lock:
+        _lo_index = None
+
+def curriculum_version() -> str:
+    """Fingerprint of the current learning objectives (changes on re-import)."""
+    return _get_lo_index().version
 
 #Asks the datavase for all different countries that exists
+@DB_SECONDS.timed(op="list_distinct_countries")
 def list_distinct_countries():
-    return [r[0] for r in get_db().execute(
-        "SELECT DISTINCT country FROM learning_objectives ORDER BY country COLLATE NOCASE"
-    ).fetchall()]
+    return list(_get_lo_index().countries)
 
 # Asks the database for all languages filtered by a specific country and grade
+@DB_SECONDS.timed(op="list_distinct_languages")
 def list_distinct_languages(country=None, grade=None):
-    q  = "SELECT DISTINCT language FROM learning_objectives WHERE 1=1"
-    ps = []
-    if country:
-        q += " AND country=?"; ps.append(country)
-    if grade:
-        q += " AND grade=?";   ps.append(grade)
-    q += " ORDER BY language COLLATE NOCASE"
-    return [r[0] for r in get_db().execute(q, ps).fetchall()]
+    return list(_get_lo_index().languages.get((country or None, grade or None), []))
 
 # Asks the database for all grades filtered by a specfic language and country
+@DB_SECONDS.timed(op="list_distinct_grades")
 def list_distinct_grades(country=None, language=None):
-    q  = "SELECT DISTINCT grade FROM learning_objectives WHERE 1=1"
-    ps = []
-    if country:
-        q += " AND country=?";  ps.append(country)
-    if language:
-        q += " AND language=?"; ps.append(language)
-    q += " ORDER BY CAST(grade AS INTEGER)"
-    return [r[0] for r in get_db().execute(q, ps).fetchall()]
+    return list(_get_lo_index().grades.get((country or None, language or None), []))
 
 # Asks the database for all topics based on the country, grade and language
+@DB_SECONDS.timed(op="list_topics")
 def list_topics(country, grade, language):
-    return [r[0] for r in get_db().execute(
-        """SELECT DISTINCT topic FROM learning_objectives
-           WHERE country=? AND grade=? AND language=?
-           ORDER BY topic COLLATE NOCASE""",
-        (country, grade, language)
-    ).fetchall()]
+    return list(_get_lo_index().topics.get((country, grade, language), []))
 
 # Looks for all learning objectives in the database that match the selection of  country, grade, language and topic
+@DB_SECONDS.timed(op="list_objectives")
 def list_objectives(country, grade, language, topic):
-    return [r[0] for r in get_db().execute(
-        """SELECT objective FROM learning_objectives
-           WHERE country=? AND grade=? AND language=? AND topic=?
-           ORDER BY objective COLLATE NOCASE""",
-        (country, grade, language, topic)
-    ).fetchall()]
+    return list(_get_lo_index().objectives.get((country, grade, language, topic), []))
 
 # Checks if the specific combination of the selected options actually exists
+@DB_SECONDS.timed(op="combo_is_valid")
 def combo_is_valid(country, grade, language, topic, objective=None) -> bool:
-    if objective:
-        row = get_db().execute(
-            """SELECT 1 FROM learning_objectives
-               WHERE country=? AND grade=? AND language=? AND topic=? AND objective=?
-               LIMIT 1""",
-            (country, grade, language, topic, objective)
-        ).fetchone()
-    else:
-        row = get_db().execute(
-            """SELECT 1 FROM learning_objectives
-               WHERE country=? AND grade=? AND language=? AND topic=?
-               LIMIT 1""",
-            (country, grade, language, topic)
-        ).fetchone()
-    return bool(row)
+    objs = (_get_lo_index().tree
+            .get(country, {}).get(grade, {}).get(language, {}).get(topic))
+    if not objs:
+        return False
+    return objective in objs if objective else True
 
+@DB_SECONDS.timed(op="set_review")
 def set_review(user_id: int, qaid: str, score: int | None, text: str | None):
     import datetime
-    db = get_db()
-    row = db.execute(
-        "SELECT 1 FROM qa_pairs WHERE qaid=? AND user_id=?",
-        (qaid, user_id)
-    ).fetchone()
-    if not row:
-        raise PermissionError("qa not found or not owned by user")
 
-    if score is None and (not text or not text.strip()):
-        db.execute(
-            "UPDATE qa_pairs SET review_score=NULL, review_text=NULL, review_at=NULL WHERE qaid=? AND user_id=?",
-            (qaid, user_id)
-        )
-    else:
-        ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        db.execute(
-            "UPDATE qa_pairs SET review_score=?, review_text=?, review_at=? WHERE qaid=? AND user_id=?",
-            (score, (text or "").strip(), ts, qaid, user_id)
-        )
-    db.commit()
+    def op(db):
+        row = db.execute(
+            "SELECT 1 FROM qa_pairs WHERE qaid=? AND user_id=? AND epoch=(SELECT history_epoch FROM users WHERE id=?)",
+            (qaid, user_id, user_id)
+        ).fetchone()
+        if not row:
+            raise PermissionError("qa not found or not owned by user")
+
+        if score is None and (not text or not text.strip()):
+            db.execute(
+                "UPDATE qa_pairs SET review_score=NULL, review_text=NULL, review_at=NULL WHERE qaid=? AND user_id=?",
+                (qaid, user_id)
+            )
+        else:
+            ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            db.execute(
+                "UPDATE qa_pairs SET review_score=?, review_text=?, review_at=? WHERE qaid=? AND user_id=?",
+                (score, (text or "").strip(), ts, qaid, user_id)
+            )
+
+    _write(op)
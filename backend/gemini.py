@@ -7,18 +7,53 @@ Design goals:
 - Read API key from env vars: GEMINI_API_KEY or GOOGLE_API_KEY.
 - Allow model override via GEMINI_MODEL (default: gemini-2.5-flash).
 - Default max tokens is 512 for more headroom.
+- Configure the SDK and build GenerativeModel objects once, then reuse them.
 """
 
 from __future__ import annotations
 
+import functools
 import os
+import threading
 from typing import Optional
 
+from prompts import END_MARKER, with_format
+
 
 class _MissingDependency(Exception):
     pass
 
 
+# Process-wide state so each request only pays for the API call itself:
+# the SDK is configured once per API key and GenerativeModel objects are
+# reused per (model id, max tokens, temperature). The SDK's client (and its
+# underlying connection) is only rebuilt when configure() is called again.
+_lock = threading.Lock()
+_configured_key: Optional[str] = None
+_models: dict = {}
+
+
+@functools.lru_cache(maxsize=1)
+def _settings() -> dict:
+    """Env-derived settings, read once per process."""
+    # Ensure a sane floor for output tokens: Gemini can occasionally emit
+    # empty candidates when the cap is too low. Allow env override.
+    floor = 512
+    env_override = os.getenv("GEMINI_MAX_OUTPUT_TOKENS")
+    try:
+        if env_override:
+            floor = max(floor, int(env_override))
+    except Exception:
+        pass
+    return {
+        "api_key": os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"),
+        "model_id": os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
+        "floor": floor,
+        "temperature": float(os.getenv("GEMINI_TEMPERATURE", "0.7")),
+    }
+
+
+@functools.lru_cache(maxsize=1)
 def _load_sdk():
     """Import the Google Generative AI SDK lazily.
 
@@ -34,37 +69,45 @@ def _load_sdk():
 
 
 def _configure(genai, api_key: Optional[str]):
-    key = api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+    global _configured_key
+    key = api_key or _settings()["api_key"]
     if not key:
         raise RuntimeError(
             "Gemini API key not set. Provide GEMINI_API_KEY or GOOGLE_API_KEY in the environment."
         )
-    genai.configure(api_key=key)
-
-
-def _build_model(genai, max_new_tokens: int):
-    model_id = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
-    # Ensure a sane floor for output tokens: Gemini can occasionally emit
-    # empty candidates when the cap is too low. Allow env override.
-    floor = 512
-    env_override = os.getenv("GEMINI_MAX_OUTPUT_TOKENS")
-    try:
-        if env_override:
-            floor = max(floor, int(env_override))
-    except Exception:
-        pass
-
-    max_tokens = int(max(max_new_tokens or 0, floor))
-
-    return genai.GenerativeModel(
-        model_id,
-        generation_config={
-            "max_output_tokens": max_tokens,
-            "temperature": float(os.getenv("GEMINI_TEMPERATURE", "0.7")),
-            # Ensure responses are returned as plain text parts
-            "response_mime_type": "text/plain",
-        },
-    )
+    if key == _configured_key:
+        return
+    with _lock:
+        if key != _configured_key:
+            genai.configure(api_key=key)
+            # Models hold clients bound to the previous configuration
+            _models.clear()
+            _configured_key = key
+
+
+def _get_model(genai, max_new_tokens: int, structured: bool = False):
+    settings = _settings()
+    max_tokens = int(max(max_new_tokens or 0, settings["floor"]))
+    key = (settings["model_id"], max_tokens, settings["temperature"], structured)
+
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            config = {
+                "max_output_tokens": max_tokens,
+                "temperature": settings["temperature"],
+                # Ensure responses are returned as plain text parts
+                "response_mime_type": "text/plain",
+            }
+            if structured:
+                # Stop as soon as the structured answer is complete
+                config["stop_sequences"] = [END_MARKER]
+            model = genai.GenerativeModel(settings["model_id"], generation_config=config)
+            _models[key] = model
+    return model
 
 
 def _candidate_text(resp) -> Optional[str]:
@@ -151,13 +194,21 @@ def _format_finish_reason(resp) -> str:
     return f"finish_reason={reason_str}"
 
 
-def generate(prompt: str, max_new_tokens: int = 512, *, api_key: Optional[str] = None) -> str:
+def _final_prompt(prompt: str, structured: bool) -> str:
+    """Append the shared response-structure instructions to structured prompts."""
+    return with_format(prompt) if structured else prompt
+
+
+def generate(prompt: str, max_new_tokens: int = 512, *, api_key: Optional[str] = None,
+             structured: bool = False) -> str:
     """Generate text from Gemini for a single prompt.
 
     Args:
         prompt: Input text prompt.
         max_new_tokens: Upper bound for output tokens.
         api_key: Optional override; otherwise uses env.
+        structured: Ask for the shared answer format (prompts.FORMAT_INSTRUCTIONS)
+            and stop at END_MARKER; used for build_structured_prompt prompts.
 
     Returns:
         The model's text response.
@@ -165,28 +216,11 @@ def generate(prompt: str, max_new_tokens: int = 512, *, api_key: Optional[str] =
     if not isinstance(prompt, str) or not prompt.strip():
         raise ValueError("prompt must be a non-empty string")
 
-    format_instructions = (
-        "Respond using the following structure exactly. Keep the section titles in bold markdown using double asterisks and end them with a colon:\n"
-        "**Math Word Problem:**\n"
-        "{one concise sentence describing the scenario}\n\n"
-        "**Question:**\n"
-        "{the single question that should be answered}\n\n"
-        "**Answer:**\n"
-        "{a short, correct answer that solves the problem}\n\n"
-        "**Learning Objective:**\n"
-        "{restate the learning objective from the prompt, or write 'Not specified.' if none is given}\n\n"
-        "**Culturally Appropriate Example:**\n"
-        "{one short sentence connecting the context to the region or culture mentioned; if none, write 'Not specified.'}\n"
-        "Do not add extra sections or commentary."
-    )
-
-    final_prompt = prompt.strip()
-    if "Math Word Problem:" not in final_prompt or "Answer:" not in final_prompt:
-        final_prompt = f"{final_prompt}\n\n{format_instructions}"
+    final_prompt = _final_prompt(prompt, structured)
 
     genai = _load_sdk()
     _configure(genai, api_key)
-    model = _build_model(genai, max_new_tokens)
+    model = _get_model(genai, max_new_tokens, structured)
 
     try:
         resp = model.generate_content(final_prompt)
@@ -207,7 +241,7 @@ def generate(prompt: str, max_new_tokens: int = 512, *, api_key: Optional[str] =
         except Exception:
             bigger = 1024
         try:
-            model2 = _build_model(genai, bigger)
+            model2 = _get_model(genai, bigger, structured)
             resp2 = model2.generate_content(final_prompt)
             content2 = _candidate_text(resp2)
             if content2:
@@ -225,3 +259,109 @@ def generate(prompt: str, max_new_tokens: int = 512, *, api_key: Optional[str] =
     # No usable text; expose finish reason and safety info to help callers debug.
     reason = _format_finish_reason(resp)
     raise RuntimeError(f"Gemini returned no text. Details: {reason}.")
+
+
+async def agenerate(prompt: str, max_new_tokens: int = 512, *, api_key: Optional[str] = None,
+                    structured: bool = False) -> str:
+    """Async counterpart of generate() built on generate_content_async.
+
+    Same prompt structure, MAX_TOKENS retry and explanatory fallbacks.
+    """
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("prompt must be a non-empty string")
+
+    final_prompt = _final_prompt(prompt, structured)
+
+    genai = _load_sdk()
+    _configure(genai, api_key)
+    model = _get_model(genai, max_new_tokens, structured)
+
+    try:
+        resp = await model.generate_content_async(final_prompt)
+    except Exception as e:
+        raise RuntimeError(f"Gemini generation failed: {e}") from e
+
+    content = _candidate_text(resp)
+    if content:
+        return content
+
+    reason = _format_finish_reason(resp)
+
+    if "MAX_TOKENS" in reason:
+        try:
+            bigger = max(int(max_new_tokens) * 2, 1024)
+        except Exception:
+            bigger = 1024
+        try:
+            model2 = _get_model(genai, bigger, structured)
+            resp2 = await model2.generate_content_async(final_prompt)
+            content2 = _candidate_text(resp2)
+            if content2:
+                return content2
+            reason2 = _format_finish_reason(resp2)
+            return f"[Gemini] Output truncated (token limit). Details: {reason2}."
+        except Exception:
+            return f"[Gemini] Output truncated (token limit). Details: {reason}."
+
+    return f"[Gemini] No content returned. Details: {reason}."
+
+
+def _chunk_text(chunk) -> str:
+    """Text of one streamed chunk, unstripped so spacing between chunks survives."""
+    try:
+        txt = getattr(chunk, "text", None)
+        if isinstance(txt, str):
+            return txt
+    except Exception:
+        # .text raises when the chunk carries no parts (e.g. a final safety/finish chunk)
+        pass
+    out = []
+    for cand in getattr(chunk, "candidates", None) or []:
+        for part in getattr(getattr(cand, "content", None), "parts", None) or []:
+            text = getattr(part, "text", None)
+            if isinstance(part, dict):
+                text = part.get("text")
+            elif isinstance(part, str):
+                text = part
+            if isinstance(text, str):
+                out.append(text)
+        if out:
+            break
+    return "".join(out)
+
+
+def stream(prompt: str, max_new_tokens: int = 512, *, api_key: Optional[str] = None,
+           structured: bool = False):
+    """Stream text chunks from Gemini for a single prompt.
+
+    Mirrors generate(): same prompt structure and model settings, but yields
+    chunks as they arrive. When nothing is produced, yields the same
+    explanatory text generate() would return.
+    """
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise ValueError("prompt must be a non-empty string")
+
+    final_prompt = _final_prompt(prompt, structured)
+
+    genai = _load_sdk()
+    _configure(genai, api_key)
+    model = _get_model(genai, max_new_tokens, structured)
+
+    try:
+        resp = model.generate_content(final_prompt, stream=True)
+    except Exception as e:
+        raise RuntimeError(f"Gemini generation failed: {e}") from e
+
+    produced = False
+    for chunk in resp:
+        text = _chunk_text(chunk)
+        if text:
+            produced = True
+            yield text
+
+    if not produced:
+        reason = _format_finish_reason(resp)
+        if "MAX_TOKENS" in reason:
+            yield f"[Gemini] Output truncated (token limit). Details: {reason}."
+        else:
+            yield f"[Gemini] No content returned. Details: {reason}."
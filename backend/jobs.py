@@ -0,0 +1,253 @@
+# jobs.py — SQLite-backed queue for asynchronous /generate requests
+"""
+POST /generate?async=1 stores the prepared request in the `jobs` table and
+returns immediately; background worker threads claim queued jobs, run the
+generation and store the result for GET /jobs/<id>.
+
+The queue lives in app.db, so jobs survive a restart and any process running
+workers can pick them up. Configuration (env):
+- JOB_WORKERS: worker threads per process (default 2, 0 disables them).
+- JOB_QUEUE_MAX: max queued + running jobs before enqueue is refused (default 100).
+- JOB_HEARTBEAT_SECONDS: how often a process refreshes heartbeat_at on the
+  jobs it is running (default 30).
+- JOB_STALE_SECONDS: a 'running' job without a heartbeat for longer than
+  this is assumed to belong to a dead process (default 120). It is queued
+  again while it has had fewer than JOB_MAX_ATTEMPTS attempts (default 3),
+  and marked failed after that, so a job that kills its worker cannot loop.
+- JOB_RETENTION_SECONDS: finished jobs are deleted after this long (default 86400).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from db import _connect, pooled_connection
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+
+# Idle workers also poll at this interval to see jobs enqueued by other processes
+_POLL_SECONDS = 1.0
+
+_wakeup = threading.Event()
+_finished = threading.Condition()
+_workers: list[threading.Thread] = []
+_running: set[str] = set()  # ids of the jobs this process is running
+_running_lock = threading.Lock()
+
+
+class QueueFull(Exception):
+    """Raised by enqueue() when the queue is at JOB_QUEUE_MAX."""
+
+
+def queue_depth() -> int:
+    """Jobs waiting or in progress (across all processes)."""
+    with pooled_connection() as con:
+        return con.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+
+def enqueue(user_id: int, payload: dict) -> str:
+    """Queue a job for user_id; returns the job id. Raises QueueFull."""
+    job_id = str(uuid.uuid4())
+    with pooled_connection() as con, con:
+        depth = con.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+        if depth >= JOB_QUEUE_MAX:
+            raise QueueFull(f"job queue is full ({depth} pending)")
+        con.execute(
+            "INSERT INTO jobs(id, user_id, status, payload_json) VALUES (?,?,'queued',?)",
+            (job_id, user_id, json.dumps(payload)),
+        )
+    _wakeup.set()
+    return job_id
+
+
+def _row_to_job(row) -> dict:
+    job = {
+        "job_id": row["id"],
+        "status": row["status"],
+        "created_at": row["created_at"],
+        "started_at": row["started_at"],
+        "finished_at": row["finished_at"],
+    }
+    if row["result_json"]:
+        job["result"] = json.loads(row["result_json"])
+    if row["error"]:
+        job["error"] = row["error"]
+    return job
+
+
+def get_job(job_id: str, user_id: int) -> Optional[dict]:
+    """Job status (and result once done), scoped to its owner; None if not found."""
+    with pooled_connection() as con:
+        row = con.execute(
+            """SELECT id, status, result_json, error, created_at, started_at, finished_at
+               FROM jobs WHERE id=? AND user_id=?""",
+            (job_id, user_id),
+        ).fetchone()
+    return _row_to_job(row) if row else None
+
+
+def saved_qaid(job_id: str) -> Optional[str]:
+    """The history row an earlier attempt of this job saved (see db.save_qa(job_id=...)), if any."""
+    with pooled_connection() as con:
+        row = con.execute("SELECT qaid FROM jobs WHERE id=?", (job_id,)).fetchone()
+    return row["qaid"] if row else None
+
+
+def wait_for_job(job_id: str, user_id: int, timeout: float) -> Optional[dict]:
+    """Long-poll: return once the job has finished or `timeout` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = get_job(job_id, user_id)
+        remaining = deadline - time.monotonic()
+        if job is None or job["status"] in ("done", "failed") or remaining <= 0:
+            return job
+        # Woken early when a worker in this process finishes a job
+        with _finished:
+            _finished.wait(min(remaining, _POLL_SECONDS))
+
+
+def _claim(con) -> Optional[tuple[str, int, dict, int]]:
+    """Atomically move the oldest queued job to 'running'; returns (id, user_id, payload, attempt)."""
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        row = con.execute(
+            "SELECT id, user_id, payload_json, attempts FROM jobs WHERE status='queued' ORDER BY rowid LIMIT 1"
+        ).fetchone()
+        if row:
+            con.execute(
+                """UPDATE jobs SET status='running', started_at=CURRENT_TIMESTAMP,
+                                  heartbeat_at=CURRENT_TIMESTAMP, attempts=attempts+1
+                   WHERE id=?""",
+                (row["id"],),
+            )
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    if not row:
+        return None
+    return row["id"], row["user_id"], json.loads(row["payload_json"]), row["attempts"] + 1
+
+
+def _finish(con, job_id: str, attempt: int, result: Optional[dict], error: Optional[str]):
+    # Only while the job is still this attempt's: if housekeeping gave it to
+    # another worker (or failed it) in the meantime, that outcome stands
+    con.execute(
+        """UPDATE jobs SET status=?, result_json=?, error=?, finished_at=CURRENT_TIMESTAMP
+           WHERE id=? AND status='running' AND attempts=?""",
+        ("failed" if error else "done", json.dumps(result) if result is not None else None, error,
+         job_id, attempt),
+    )
+    with _finished:
+        _finished.notify_all()
+
+
+def _heartbeat_loop():
+    # Marks this process's running jobs as alive, so housekeeping in any
+    # process only reclaims jobs whose process has stopped beating
+    con = _connect()
+    con.isolation_level = None
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _running_lock:
+            ids = list(_running)
+        if not ids:
+            continue
+        try:
+            con.execute(
+                f"""UPDATE jobs SET heartbeat_at=CURRENT_TIMESTAMP
+                    WHERE status='running' AND id IN ({",".join("?" * len(ids))})""",
+                ids,
+            )
+        except Exception as e:
+            print("Job heartbeat error:", e)
+
+
+def _housekeeping(con):
+    # Jobs whose process stopped heartbeating: retry them while attempts
+    # remain, fail them after that. Also drop old finished jobs.
+    stale = (
+        "status='running' AND COALESCE(heartbeat_at, started_at) < datetime('now', ?)"
+    )
+    age = (f"-{JOB_STALE_SECONDS} seconds",)
+    con.execute(
+        f"UPDATE jobs SET status='queued' WHERE {stale} AND attempts < ?",
+        age + (JOB_MAX_ATTEMPTS,),
+    )
+    con.execute(
+        f"""UPDATE jobs SET status='failed', finished_at=CURRENT_TIMESTAMP,
+                           error='worker stopped responding ' || attempts || ' time(s); giving up'
+            WHERE {stale} AND attempts >= ?""",
+        age + (JOB_MAX_ATTEMPTS,),
+    )
+    con.execute(
+        """DELETE FROM jobs
+           WHERE status IN ('done', 'failed') AND finished_at < datetime('now', ?)""",
+        (f"-{JOB_RETENTION_SECONDS} seconds",),
+    )
+
+
+def _worker_loop(app, handler: Callable[[int, dict, str], dict]):
+    con = _connect()
+    con.isolation_level = None  # autocommit; _claim manages its own transaction
+    last_housekeeping = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_housekeeping > 60:
+                _housekeeping(con)
+                last_housekeeping = time.monotonic()
+
+            job = _claim(con)
+            if job is None:
+                _wakeup.wait(_POLL_SECONDS)
+                _wakeup.clear()
+                continue
+
+            job_id, user_id, payload, attempt = job
+            with _running_lock:
+                _running.add(job_id)
+            try:
+                with app.app_context():
+                    result = handler(user_id, payload, job_id)
+            except Exception as e:
+                _finish(con, job_id, attempt, None, str(e))
+            else:
+                _finish(con, job_id, attempt, result, None)
+            finally:
+                with _running_lock:
+                    _running.discard(job_id)
+        except Exception as e:
+            # Keep the worker alive through transient DB errors (e.g. locked)
+            print("Job worker error:", e)
+            time.sleep(_POLL_SECONDS)
+
+
+def start_workers(app, handler: Callable[[int, dict, str], dict], n: int = JOB_WORKERS):
+    """
+    Start n daemon worker threads running handler(user_id, payload, job_id) per job.
+    A job can run more than once (see JOB_STALE_SECONDS), so a handler that
+    writes should key the write on job_id.
+    """
+    if _workers or n <= 0:
+        return
+    t = threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True)
+    t.start()
+    _workers.append(t)
+    for i in range(n):
+        t = threading.Thread(target=_worker_loop, args=(app, handler), name=f"job-worker-{i}", daemon=True)
+        t.start()
+        _workers.append(t)
@@ -0,0 +1,202 @@
+"""
+Response cache for llm_router.generate.
+
+Identical (model, prompt, generation params) requests are answered from a
+bounded in-memory LRU, backed by a SQLite file so entries survive restarts
+and are shared between worker processes.
+
+Configuration (env):
+- LLM_CACHE_MODELS: comma-separated models to cache (e.g. "gemini,openai"),
+  "*" for all. Empty (default) disables the cache entirely.
+- LLM_CACHE_TTL_SECONDS: entry lifetime (default 86400).
+- LLM_CACHE_MAX_ENTRIES: in-memory LRU size in keys (default 1024).
+- LLM_CACHE_DB_MAX_ROWS: SQLite tier size in responses (default 50000); 0 disables it.
+- LLM_CACHE_VARIANTS: "variety" mode. Keep up to N different responses per
+  key: the first N requests go to the model, later ones rotate through them.
+- LLM_CACHE_PATH: SQLite file (default backend/llm_cache.db).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+CACHE_MODELS = {m.strip().lower() for m in os.getenv("LLM_CACHE_MODELS", "").split(",") if m.strip()}
+TTL_SECONDS = _env_int("LLM_CACHE_TTL_SECONDS", 86400)
+MAX_ENTRIES = max(1, _env_int("LLM_CACHE_MAX_ENTRIES", 1024))
+DB_MAX_ROWS = max(0, _env_int("LLM_CACHE_DB_MAX_ROWS", 50000))
+VARIANTS = max(1, _env_int("LLM_CACHE_VARIANTS", 1))
+CACHE_PATH = os.getenv("LLM_CACHE_PATH") or os.path.join(os.path.dirname(__file__), "llm_cache.db")
+
+# Trim the SQLite tier every this many inserts rather than on each one
+_PRUNE_EVERY = 100
+
+
+def enabled_for(model: str) -> bool:
+    return "*" in CACHE_MODELS or model in CACHE_MODELS
+
+
+def make_key(model: str, prompt: str, params: dict) -> str:
+    raw = json.dumps([model, prompt, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("variants", "next_idx")
+
+    def __init__(self, variants: list[tuple[str, float, int]]):
+        self.variants = variants  # [(text, created_at, variant slot)]
+        self.next_idx = 0
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + SQLite) cache with TTL and variant rotation."""
+
+    def __init__(self, path: str, max_entries: int, db_max_rows: int, ttl: int, variants: int):
+        self._path = path
+        self._max_entries = max_entries
+        self._db_max_rows = db_max_rows
+        self._ttl = ttl
+        self._variants = variants
+        self._mem: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._con: Optional[sqlite3.Connection] = None
+        self._inserts = 0
+
+    # --- SQLite tier ---
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self._db_max_rows:
+            return None
+        if self._con is None:
+            con = sqlite3.connect(self._path, timeout=5.0, check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL;")
+            con.execute("PRAGMA synchronous=NORMAL;")
+            con.executescript("""
+            CREATE TABLE IF NOT EXISTS llm_cache(
+              key TEXT NOT NULL,
+              variant INTEGER NOT NULL,
+              response TEXT NOT NULL,
+              created_at REAL NOT NULL,
+              PRIMARY KEY(key, variant)
+            );
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at);
+            """)
+            self._con = con
+        return self._con
+
+    def _db_load(self, key: str, now: float) -> Optional[_Entry]:
+        con = self._db()
+        if con is None:
+            return None
+        rows = con.execute(
+            "SELECT response, created_at, variant FROM llm_cache WHERE key=? AND created_at>? ORDER BY variant",
+            (key, now - self._ttl),
+        ).fetchall()
+        return _Entry([(r[0], r[1], r[2]) for r in rows]) if rows else None
+
+    def _db_store(self, key: str, variant: int, text: str, now: float):
+        con = self._db()
+        if con is None:
+            return
+        con.execute(
+            "INSERT OR REPLACE INTO llm_cache(key, variant, response, created_at) VALUES (?,?,?,?)",
+            (key, variant, text, now),
+        )
+        self._inserts += 1
+        if self._inserts % _PRUNE_EVERY == 0:
+            con.execute("DELETE FROM llm_cache WHERE created_at<=?", (now - self._ttl,))
+            # Size bound: drop the oldest rows beyond the cap
+            con.execute(
+                """DELETE FROM llm_cache WHERE rowid IN (
+                     SELECT rowid FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                   )""",
+                (self._db_max_rows,),
+            )
+        con.commit()
+
+    # --- public API ---
+    def get(self, key: str) -> Optional[str]:
+        """
+        Return a cached response, or None when the caller should generate.
+        In variety mode a key only starts serving hits once it holds all of
+        its variants; hits then rotate through them.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None:
+                entry = self._db_load(key, now)
+                if entry is None:
+                    return None
+                self._remember(key, entry)
+            else:
+                self._mem.move_to_end(key)
+
+            entry.variants = [v for v in entry.variants if now - v[1] < self._ttl]
+            if len(entry.variants) < self._variants:
+                if not entry.variants:
+                    self._mem.pop(key, None)
+                return None
+
+            text = entry.variants[entry.next_idx % len(entry.variants)][0]
+            entry.next_idx += 1
+            return text
+
+    def put(self, key: str, text: str):
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is None:
+                entry = self._db_load(key, now) or _Entry([])
+                self._remember(key, entry)
+            entry.variants = [v for v in entry.variants if now - v[1] < self._ttl]
+            if len(entry.variants) >= self._variants:
+                return
+            # Reuse the first slot not held by a live variant (expired ones get overwritten)
+            used = {v[2] for v in entry.variants}
+            slot = next(i for i in range(self._variants) if i not in used)
+            entry.variants.append((text, now, slot))
+            self._db_store(key, slot, text, now)
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            con = self._db()
+            if con is not None:
+                con.execute("DELETE FROM llm_cache")
+                con.commit()
+
+    def _remember(self, key: str, entry: _Entry):
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self._max_entries:
+            self._mem.popitem(last=False)
+
+
+_cache = ResponseCache(CACHE_PATH, MAX_ENTRIES, DB_MAX_ROWS, TTL_SECONDS, VARIANTS)
+
+
+def get(model: str, prompt: str, params: dict) -> Optional[str]:
+    return _cache.get(make_key(model, prompt, params))
+
+
+def put(model: str, prompt: str, params: dict, text: str) -> None:
+    _cache.put(make_key(model, prompt, params), text)
+
+
+def clear() -> None:
+    _cache.clear()
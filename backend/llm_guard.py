@@ -0,0 +1,201 @@
+# llm_guard.py — per-provider circuit breaker and adaptive concurrency limit
+"""
+Protects the worker pool from a struggling remote provider (OpenAI, Gemini).
+
+Circuit breaker: after LLM_BREAKER_FAILURES consecutive failures the circuit
+opens and calls are rejected immediately for LLM_BREAKER_OPEN_SECONDS. It
+then goes half-open and lets LLM_BREAKER_PROBES trial calls through; a
+success closes it again, a failure re-opens it. Every call is tied to the
+breaker generation that admitted it: results of calls started before the
+last state change (still in flight when it tripped, say) are ignored, so
+they can neither extend the open window nor close a half-open breaker.
+
+Adaptive concurrency (AIMD): each provider may have at most `limit` calls in
+flight. Every fast success raises the limit additively (by 1/limit, i.e.
+about +1 per round of calls); a failure or a call slower than
+LLM_LIMIT_TARGET_MS halves it. Calls over the limit are rejected at once
+rather than queued behind a slow provider.
+
+Rejections raise ProviderUnavailable, which the router's failover policy
+treats like any other error (so traffic is redirected when LLM_FALLBACKS is
+set) and the API reports as 503.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("LLM_BREAKER_OPEN_SECONDS", "30"))
+BREAKER_PROBES = int(os.getenv("LLM_BREAKER_PROBES", "1"))
+
+LIMIT_INITIAL = float(os.getenv("LLM_LIMIT_INITIAL", "8"))
+LIMIT_MIN = float(os.getenv("LLM_LIMIT_MIN", "1"))
+LIMIT_MAX = float(os.getenv("LLM_LIMIT_MAX", "64"))
+LIMIT_TARGET_MS = float(os.getenv("LLM_LIMIT_TARGET_MS", "15000"))
+
+# Local inference has its own batching; only remote APIs are guarded
+GUARDED = ("openai", "gemini")
+
+
+class ProviderUnavailable(RuntimeError):
+    """The provider's circuit is open or its concurrency limit is reached."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int, open_seconds: float, probes: int):
+        self._threshold = failures
+        self._open_seconds = open_seconds
+        self._probes = probes
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._generation = 0  # bumped on every state change
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = 0
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self._open_seconds - time.monotonic())
+
+    def allow(self) -> Optional[tuple[int, bool]]:
+        """
+        Admit a call: returns its ticket (generation, is_probe) for record()
+        / cancel_probe(), or None when the call is rejected.
+        """
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self._open_seconds:
+                    return None
+                self._set_state("half_open")
+                self._probing = 0
+            if self.state == "half_open":
+                if self._probing >= self._probes:
+                    return None
+                self._probing += 1
+                return self._generation, True
+            return self._generation, False
+
+    def record(self, ticket: tuple[int, bool], ok: bool):
+        with self._lock:
+            generation, probe = ticket
+            if generation != self._generation:
+                return  # admitted before the last state change
+            if self.state == "half_open":
+                if not probe:
+                    return
+                self._probing = max(0, self._probing - 1)
+                if ok:
+                    self._set_state("closed")
+                    self._failures = 0
+                else:
+                    self._trip()
+                return
+            if ok:
+                self._failures = 0
+            else:
+                self._failures += 1
+                if self._failures >= self._threshold:
+                    self._trip()
+
+    def cancel_probe(self, ticket: tuple[int, bool]):
+        """Hand back a half-open probe slot that allow() granted but was not used."""
+        with self._lock:
+            generation, probe = ticket
+            if probe and generation == self._generation and self.state == "half_open":
+                self._probing = max(0, self._probing - 1)
+
+    def _set_state(self, state: str):
+        self.state = state
+        self._generation += 1
+
+    def _trip(self):
+        self._set_state("open")
+        self._opened_at = time.monotonic()
+        self._failures = 0
+
+
+class AIMDLimiter:
+    def __init__(self, initial: float, minimum: float, maximum: float, target_seconds: float):
+        self._min = minimum
+        self._max = maximum
+        self._target = target_seconds
+        self._lock = threading.Lock()
+        self.limit = max(minimum, min(initial, maximum))
+        self.inflight = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.inflight >= int(self.limit):
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self, seconds: float, ok: Optional[bool]):
+        """Free a slot and adapt the limit; ok=None frees it without adapting."""
+        with self._lock:
+            self.inflight -= 1
+            if ok is None:
+                return
+            if ok and seconds <= self._target:
+                self.limit = min(self._max, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self._min, self.limit / 2)
+
+
+class ProviderGuard:
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_OPEN_SECONDS, BREAKER_PROBES)
+        self.limiter = AIMDLimiter(LIMIT_INITIAL, LIMIT_MIN, LIMIT_MAX, LIMIT_TARGET_MS / 1000.0)
+
+    def acquire(self) -> tuple[int, bool]:
+        """Reserve a slot or raise ProviderUnavailable. Pass the returned ticket to release()."""
+        ticket = self.breaker.allow()
+        if ticket is None:
+            raise ProviderUnavailable(
+                f"{self.name} is temporarily unavailable (circuit open)",
+                retry_after=self.breaker.retry_after() or 1.0,
+            )
+        if not self.limiter.try_acquire():
+            self.breaker.cancel_probe(ticket)
+            raise ProviderUnavailable(f"{self.name} is at its concurrency limit")
+        return ticket
+
+    def release(self, ticket: tuple[int, bool], seconds: float, error: Optional[BaseException] = None):
+        """Return the slot taken by acquire(); `error` is what the call raised, if anything."""
+        if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # Abandoned by the caller (e.g. a lost hedge): says nothing about the provider
+            self.limiter.release(seconds, None)
+            self.breaker.cancel_probe(ticket)
+            return
+        # A bad request (ValueError) is the caller's fault, not the provider's
+        ok = error is None or isinstance(error, ValueError)
+        self.limiter.release(seconds, ok)
+        self.breaker.record(ticket, ok)
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "limit": round(self.limiter.limit, 2),
+            "inflight": self.limiter.inflight,
+        }
+
+
+_guards = {name: ProviderGuard(name) for name in GUARDED}
+
+
+def guard_for(provider: str):
+    """The provider's guard, or None for unguarded (local) backends."""
+    return _guards.get(provider)
+
+
+def guard_states() -> dict:
+    return {name: g.snapshot() for name, g in _guards.items()}
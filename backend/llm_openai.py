@@ -2,7 +2,9 @@
 import os
 from pathlib import Path
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from prompts import END_MARKER, FORMAT_INSTRUCTIONS
 
 load_dotenv(Path(__file__).with_name(".env"))
 key = os.getenv("OPENAI_API_KEY")
@@ -11,14 +13,37 @@ if not key:
     raise RuntimeError(return_msg)
 MODEL = os.getenv("OPENAI_MODEL", "gpt-4o")
 client = OpenAI()  # SDK reads OPENAI_API_KEY from env
+aclient = AsyncOpenAI()  # same, for the async router (llm_router.agenerate)
+
+def _request(prompt, max_new_tokens, structured):
+    messages = [{"role":"user","content": str(prompt)}]
+    kwargs = dict(model="gpt-4o-mini", max_tokens=max_new_tokens, temperature=0.2)
+    if structured:
+        # Shared answer structure as a system message; the model stops at END_MARKER
+        messages.insert(0, {"role":"system","content": FORMAT_INSTRUCTIONS})
+        kwargs["stop"] = [END_MARKER]
+    return dict(kwargs, messages=messages)
+
+def generate(prompt, max_new_tokens=256, *, structured=False):
+    if not prompt or not str(prompt).strip():
+        return "Empty prompt."
+    r = client.chat.completions.create(**_request(prompt, max_new_tokens, structured))
+    return r.choices[0].message.content.strip()
 
-def generate(prompt, max_new_tokens=256):
+async def agenerate(prompt, max_new_tokens=256, *, structured=False):
     if not prompt or not str(prompt).strip():
         return "Empty prompt."
-    r = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role":"user","content": str(prompt)}],
-        max_tokens=max_new_tokens,
-        temperature=0.2,
-    )
+    r = await aclient.chat.completions.create(**_request(prompt, max_new_tokens, structured))
     return r.choices[0].message.content.strip()
+
+def stream(prompt, max_new_tokens=256, *, structured=False):
+    if not prompt or not str(prompt).strip():
+        yield "Empty prompt."
+        return
+    chunks = client.chat.completions.create(**_request(prompt, max_new_tokens, structured), stream=True)
+    for chunk in chunks:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
@@ -1,23 +1,225 @@
-# LLM.py 
-from transformers import AutoModelForCausalLM, AutoTokenizer
-import torch
+# LLM.py
+from concurrent.futures import Future
+from contextlib import contextmanager
+from multiprocessing.connection import Client
+import copy
+import gc
+import os
+import queue
+import threading
+import time
 import re
+import secrets
 
+from prompts import END_MARKER, FORMAT_INSTRUCTIONS, STRUCTURED_PROMPT_PREFIX, answer_complete, strip_end_marker
 
 # Model name
 MODEL_NAME = "Qwen/Qwen3-0.6B"
 
-#loading the model and tokenizer 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    torch_dtype="auto",
-    device_map="auto"
-)
+# Micro-batching: requests that arrive within BATCH_MAX_WAIT_MS of each other
+# are padded into one model.generate call (up to BATCH_MAX_SIZE prompts).
+# Set QWEN_BATCH_MAX_SIZE=1 to disable batching.
+BATCH_MAX_SIZE = max(1, int(os.getenv("QWEN_BATCH_MAX_SIZE", "8")))
+BATCH_MAX_WAIT_MS = max(0.0, float(os.getenv("QWEN_BATCH_MAX_WAIT_MS", "15")))
+
+# The model is loaded on first use rather than at import, and dropped again
+# after QWEN_IDLE_UNLOAD_SECONDS without requests (0 keeps it loaded forever).
+IDLE_UNLOAD_SECONDS = max(0.0, float(os.getenv("QWEN_IDLE_UNLOAD_SECONDS", "0")))
+
+# CPU inference profile (applied when the model loads):
+#   QWEN_PROFILE=default  torch_dtype="auto", device_map="auto" (previous behaviour)
+#                fp32     float32 on CPU
+#                bf16     bfloat16 weights; fast on CPUs with AVX512-BF16/AMX, emulated elsewhere
+#                int8     float32 load + dynamic int8 quantization of every nn.Linear (CPU only)
+#   QWEN_NUM_THREADS / QWEN_INTEROP_THREADS  torch intra-/inter-op thread counts (0 = torch default)
+#   QWEN_COMPILE=1  wrap the forward pass in torch.compile (slow first call, faster decoding)
+PROFILES = ("default", "fp32", "bf16", "int8")
+PROFILE = os.getenv("QWEN_PROFILE", "default").strip().lower()
+if PROFILE not in PROFILES:
+    raise ValueError(f"QWEN_PROFILE must be one of {', '.join(PROFILES)} (got {PROFILE!r})")
+NUM_THREADS = int(os.getenv("QWEN_NUM_THREADS", "0"))
+INTEROP_THREADS = int(os.getenv("QWEN_INTEROP_THREADS", "0"))
+COMPILE = os.getenv("QWEN_COMPILE") == "1"
+
+# Prompt-prefix KV cache: the attention keys/values for these fixed prompt
+# openings (inside the chat template) are computed once per loaded model, and
+# single-prompt generations that start with one only prefill the remainder.
+# Padded batches cannot share it (left padding shifts the prefix), so batches
+# of two or more take the normal path. QWEN_PREFIX_CACHE=0 disables it.
+PREFIX_CACHE = os.getenv("QWEN_PREFIX_CACHE", "1") != "0"
+# (structured, text after the chat template's opening): structured prompts
+# start with the format system message and the fixed opening; free-form
+# prompts share only the template's own opening
+PREFIXES = [(True, STRUCTURED_PROMPT_PREFIX), (False, "")]
+
+# Out-of-process mode: with QWEN_SERVER_ADDRESS set ("host:port" or a Unix
+# socket path) generate() and stream() are forwarded to qwen_server.py and
+# this process never loads the model.
+SERVER_ADDRESS = os.getenv("QWEN_SERVER_ADDRESS", "").strip() or None
+# The connection unpickles whatever an authenticated peer sends, so there is
+# no built-in key: QWEN_SERVER_AUTHKEY, or else a random key that the server
+# writes to QWEN_SERVER_AUTHKEY_FILE (owner-only) on first start.
+SERVER_AUTHKEY_FILE = os.getenv("QWEN_SERVER_AUTHKEY_FILE") or os.path.expanduser("~/.mathapp-qwen-server.key")
+SERVER_TIMEOUT = float(os.getenv("QWEN_SERVER_TIMEOUT", "300"))
+# stream() gives up when no new text arrives for this long (prefill included)
+STREAM_TIMEOUT = float(os.getenv("QWEN_STREAM_TIMEOUT", "120"))
+
+_tokenizer = None
+_model = None
+_load_lock = threading.Lock()
+_inflight = 0
+_last_used = 0.0
+_reaper = None
+_prefix_kv = None  # [(token ids, cache)] for the loaded model; built on first use
+_prefix_lock = threading.Lock()
+
+#loading the model and tokenizer (once, guarded so concurrent first requests load it a single time)
+def _load():
+    global _tokenizer, _model, _reaper
+    if _model is not None:
+        return
+    with _load_lock:
+        if _model is not None:
+            return
+        # Heavy imports live here so importing this module stays cheap
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        _set_threads(torch)
+        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME, **_load_kwargs(torch))
+        model = _apply_profile(torch, model)
+
+        # Decoder-only models must be left-padded so every prompt ends right where
+        # generation starts.
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        _tokenizer, _model = tokenizer, model
+
+        if IDLE_UNLOAD_SECONDS and _reaper is None:
+            _reaper = threading.Thread(target=_reap_idle, name="qwen-idle-unload", daemon=True)
+            _reaper.start()
+
+def _set_threads(torch):
+    if NUM_THREADS:
+        torch.set_num_threads(NUM_THREADS)
+    if INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(INTEROP_THREADS)
+        except RuntimeError:
+            # Only settable before torch runs its first parallel op (e.g. after unload())
+            pass
+
+def _load_kwargs(torch) -> dict:
+    if PROFILE == "default":
+        return {"torch_dtype": "auto", "device_map": "auto"}
+    # The explicit profiles are CPU profiles
+    dtype = torch.bfloat16 if PROFILE == "bf16" else torch.float32
+    return {"torch_dtype": dtype, "low_cpu_mem_usage": True}
+
+def _apply_profile(torch, model):
+    model.eval()
+    if PROFILE == "int8":
+        # Weights of Linear layers stored as int8; activations are quantized on the fly
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if COMPILE:
+        # generate() calls forward once per token with a growing sequence, hence dynamic shapes
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+def _generate_ids(model, prefix_cache=None, **kwargs):
+    # inference_mode is thread-local, so it wraps the call on whichever thread runs it
+    import torch
+    with torch.inference_mode():
+        if prefix_cache is not None:
+            # generate() appends to the cache it is given; keep the shared one pristine
+            kwargs["past_key_values"] = copy.deepcopy(prefix_cache)
+        return model.generate(**kwargs)
+
+def _prefix_entries(tokenizer, model):
+    global _prefix_kv
+    if _prefix_kv is not None:
+        return _prefix_kv
+    with _prefix_lock:
+        if _prefix_kv is None:
+            import torch
+            marker = "\x00"
+            entries = []
+            for structured, prefix in PREFIXES:
+                head = _build_chat_text(tokenizer, marker, structured).split(marker)[0]
+                ids = tokenizer(head + prefix, return_tensors="pt").input_ids.to(model.device)
+                # The last token may merge with whatever follows the prefix; leave it out
+                ids = ids[:, :-1]
+                with torch.inference_mode():
+                    cache = model(input_ids=ids, use_cache=True).past_key_values
+                entries.append((ids, cache))
+            _prefix_kv = entries
+    return _prefix_kv
+
+def _prefix_cache_for(tokenizer, model, input_ids):
+    """The precomputed cache for the prefix that input_ids (one row) starts with, if any."""
+    if not PREFIX_CACHE:
+        return None
+    import torch
+    for ids, cache in _prefix_entries(tokenizer, model):
+        n = ids.shape[1]
+        if input_ids.shape[1] > n and torch.equal(input_ids[0, :n], ids[0]):
+            return cache
+    return None
+
+#Frees the model and tokenizer; the next request loads them again
+def unload() -> bool:
+    """Drop the model if no generation is running. Returns True if it was unloaded."""
+    global _tokenizer, _model, _prefix_kv
+    with _load_lock:
+        if _model is None or _inflight:
+            return False
+        _tokenizer = _model = None
+        _prefix_kv = None
+    gc.collect()
+    return True
+
+def _reap_idle():
+    while True:
+        time.sleep(max(1.0, IDLE_UNLOAD_SECONDS / 4))
+        if _model is not None and not _inflight and time.monotonic() - _last_used >= IDLE_UNLOAD_SECONDS:
+            unload()
+
+@contextmanager
+def _use_model():
+    """Load on demand and mark the model busy so the idle reaper leaves it alone."""
+    global _inflight, _last_used
+    while True:
+        _load()
+        with _load_lock:
+            # unload() may have won the race between _load() and here
+            if _model is not None:
+                _inflight += 1
+                tokenizer, model = _tokenizer, _model
+                break
+    try:
+        yield tokenizer, model
+    finally:
+        with _load_lock:
+            _inflight -= 1
+            _last_used = time.monotonic()
+
+#Optional warm-up so the first real request does not pay the load time
+def warmup() -> None:
+    global _last_used
+    if SERVER_ADDRESS:
+        return  # the server loads the model in its workers
+    _load()
+    _last_used = time.monotonic()
 
 #This function prepares the prompt in a way that the model will understand
-def _build_chat_text(prompt: str) -> str:
+def _build_chat_text(tokenizer, prompt: str, structured: bool = False) -> str:
     messages = [{"role": "user", "content": prompt}]
+    if structured:
+        # Shared answer structure (prompts.FORMAT_INSTRUCTIONS) as the system message
+        messages.insert(0, {"role": "system", "content": FORMAT_INSTRUCTIONS})
     return tokenizer.apply_chat_template(
         messages,
         tokenize=False,
@@ -35,19 +237,326 @@ def _strip_think(text: str) -> str:
     text = text.replace("</think>", "")
     return text.strip()
 
-#This function runs the prompt and gives the final answer
-def generate(prompt: str, max_new_tokens: int = 256) -> str:
-    chat_text = _build_chat_text(prompt)
-    model_inputs = tokenizer([chat_text], return_tensors="pt").to(model.device)
+# Tokens decoded per step while looking for the end of the answer
+_STOP_WINDOW = 48
 
-    generated_ids = model.generate(
-        **model_inputs,
-        max_new_tokens=max_new_tokens
-    )
+def _stopping_criteria(tokenizer, prompt_len: int, structured: list[bool], cancel: threading.Event | None = None):
+    """
+    Stop each structured row as soon as its answer is complete
+    (prompts.answer_complete). Free-form rows run to EOS or their token
+    limit. Every row stops once `cancel` is set. None when there is
+    nothing to check.
+    """
+    if not any(structured) and cancel is None:
+        return None
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class _Cancelled(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), cancel.is_set(), dtype=torch.bool, device=input_ids.device)
+
+    class _AnswerComplete(StoppingCriteria):
+        def __init__(self):
+            # Per row: where decoding starts once the last section heading is in view
+            self._anchor = {}
+
+        def __call__(self, input_ids, scores, **kwargs):
+            done = []
+            for i, row in enumerate(input_ids):
+                if not structured[i]:
+                    done.append(False)
+                    continue
+                start = self._anchor.get(i, max(prompt_len, row.shape[0] - _STOP_WINDOW))
+                text = tokenizer.decode(row[start:], skip_special_tokens=True)
+                if i not in self._anchor and "Example:" in text:
+                    # Back up a little so the whole heading stays in view
+                    self._anchor[i] = max(prompt_len, start - 16)
+                done.append(answer_complete(text))
+            return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    criteria = StoppingCriteriaList()
+    if any(structured):
+        criteria.append(_AnswerComplete())
+    if cancel is not None:
+        criteria.append(_Cancelled())
+    return criteria
+
+#Runs several prompts through one padded model.generate call
+def generate_batch(prompts: list[str], max_new_tokens: int | list[int] = 256,
+                   structured: bool | list[bool] = False) -> list[str]:
+    """
+    Generate answers for many prompts at once.
+    max_new_tokens may be a single int or one limit per prompt; the batch runs
+    to the largest limit and each output is trimmed back to its own.
+    structured (likewise single or per prompt) asks for the shared answer
+    format (prompts.FORMAT_INSTRUCTIONS).
+    """
+    if isinstance(max_new_tokens, int):
+        limits = [max_new_tokens] * len(prompts)
+    else:
+        limits = list(max_new_tokens)
+    if isinstance(structured, bool):
+        structured = [structured] * len(prompts)
+    if not prompts:
+        return []
 
-    # Keep only newly generated tokens
-    output_ids = generated_ids[0][len(model_inputs.input_ids[0]):]
+    with _use_model() as (tokenizer, model):
+        chat_texts = [_build_chat_text(tokenizer, p, f) for p, f in zip(prompts, structured)]
+        model_inputs = tokenizer(chat_texts, return_tensors="pt", padding=True).to(model.device)
 
-    content = tokenizer.decode(output_ids, skip_special_tokens=True).strip()
-    content = _strip_think(content)
-    return content
+        prefix_cache = _prefix_cache_for(tokenizer, model, model_inputs.input_ids) if len(prompts) == 1 else None
+        generated_ids = _generate_ids(
+            model,
+            prefix_cache,
+            **model_inputs,
+            max_new_tokens=max(limits),
+            pad_token_id=tokenizer.pad_token_id,
+            stopping_criteria=_stopping_criteria(tokenizer, model_inputs.input_ids.shape[1], structured),
+        )
+
+        # Keep only newly generated tokens (all rows share the padded prompt length)
+        prompt_len = model_inputs.input_ids.shape[1]
+        out = []
+        for row, limit in zip(generated_ids, limits):
+            output_ids = row[prompt_len:prompt_len + limit]
+            content = tokenizer.decode(output_ids, skip_special_tokens=True).strip()
+            out.append(strip_end_marker(_strip_think(content)))
+    return out
+
+
+#Yields the answer piece by piece while the model is still generating
+def stream(prompt: str, max_new_tokens: int = 256, *, structured: bool = False):
+    """
+    Stream the answer for one prompt as text chunks.
+    Generation runs on a helper thread feeding a TextIteratorStreamer; chunks are
+    re-cleaned with _strip_think so thinking content never reaches the caller.
+    An error in generation is raised here; TimeoutError when no text arrives
+    for STREAM_TIMEOUT seconds.
+    """
+    if SERVER_ADDRESS:
+        for kind, payload in _server_request("stream", prompt, max_new_tokens, structured):
+            if kind == "chunk":
+                yield payload
+        return
+
+    from transformers import TextIteratorStreamer
+
+    with _use_model() as (tokenizer, model):
+        chat_text = _build_chat_text(tokenizer, prompt, structured)
+        model_inputs = tokenizer([chat_text], return_tensors="pt").to(model.device)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True,
+                                        timeout=STREAM_TIMEOUT)
+        # Set when the caller stops reading (disconnect, timeout): generation stops at the next token
+        cancel = threading.Event()
+        failure = []
+
+        def run():
+            try:
+                _generate_ids(
+                    model,
+                    _prefix_cache_for(tokenizer, model, model_inputs.input_ids),
+                    **model_inputs,
+                    max_new_tokens=max_new_tokens,
+                    streamer=streamer,
+                    stopping_criteria=_stopping_criteria(
+                        tokenizer, model_inputs.input_ids.shape[1], [structured], cancel),
+                )
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                # Without this a failed generate() would leave the loop below waiting
+                streamer.end()
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+
+        full = ""
+        emitted = ""
+        try:
+            for piece in streamer:
+                full += piece
+                # Hold back while the output could still be the start of a <think> tag
+                if "<think>".startswith(full.lstrip()):
+                    continue
+                clean = strip_end_marker(_strip_think(full))
+                # Likewise while the tail could be the start of END_MARKER
+                for n in range(min(len(END_MARKER) - 1, len(clean)), 0, -1):
+                    if END_MARKER.startswith(clean[-n:]):
+                        clean = clean[:-n]
+                        break
+                if len(clean) > len(emitted) and clean.startswith(emitted):
+                    yield clean[len(emitted):]
+                    emitted = clean
+        except queue.Empty:
+            raise TimeoutError(f"Qwen produced no output for {STREAM_TIMEOUT:.0f}s") from None
+        finally:
+            cancel.set()
+            # Keep the model marked busy (_use_model) until generation has really stopped
+            worker.join()
+        if failure:
+            raise failure[0]
+
+        # Release anything held back that turned out not to be a marker
+        clean = strip_end_marker(_strip_think(full))
+        if len(clean) > len(emitted) and clean.startswith(emitted):
+            yield clean[len(emitted):]
+
+
+class _MicroBatcher:
+    """
+    Collects concurrent generate() calls into batches.
+    A single scheduler thread waits for the first request, keeps collecting
+    until the batch is full or the wait window closes, runs the batch, and
+    resolves each caller's Future with its own text.
+    """
+
+    def __init__(self, run_batch, max_batch_size: int, max_wait_ms: float):
+        self._run_batch = run_batch
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[tuple[str, int, bool, Future]]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, prompt: str, max_new_tokens: int, structured: bool = False) -> Future:
+        fut: Future = Future()
+        self._ensure_started()
+        self._queue.put((prompt, max_new_tokens, structured, fut))
+        return fut
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._loop, name="qwen-batcher", daemon=True)
+                t.start()
+                self._thread = t
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Requests already waiting are taken immediately, even after the window
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            live = [item for item in batch if item[3].set_running_or_notify_cancel()]
+            if not live:
+                continue
+            try:
+                texts = self._run_batch([p for p, _, _, _ in live], [n for _, n, _, _ in live],
+                                        [f for _, _, f, _ in live])
+            except Exception as e:
+                for _, _, _, fut in live:
+                    fut.set_exception(e)
+            else:
+                for (_, _, _, fut), text in zip(live, texts):
+                    fut.set_result(text)
+
+
+_batcher = _MicroBatcher(generate_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+
+def batch_queue_depth() -> int:
+    """Requests waiting for the micro-batcher in this process."""
+    return _batcher._queue.qsize()
+
+def parse_address(raw: str):
+    """'host:port' -> (host, port) for TCP; anything else is a Unix socket path."""
+    host, sep, port = raw.rpartition(":")
+    if sep and port.isdigit():
+        return (host or "127.0.0.1", int(port))
+    return raw
+
+def server_authkey(create: bool = False) -> bytes:
+    """
+    Shared secret for qwen_server.py connections: QWEN_SERVER_AUTHKEY if set,
+    else the contents of SERVER_AUTHKEY_FILE. With create=True (the server) a
+    missing file is created with a random key and mode 0600. Raises
+    RuntimeError when there is no key or the file is readable by others.
+    """
+    key = os.getenv("QWEN_SERVER_AUTHKEY", "").strip()
+    if key:
+        return key.encode()
+    path = SERVER_AUTHKEY_FILE
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_hex(32))
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise RuntimeError(
+            "no Qwen server key: set QWEN_SERVER_AUTHKEY, or start qwen_server.py "
+            f"once so it creates {path}"
+        ) from None
+    if os.name == "posix" and st.st_mode & 0o077:
+        raise RuntimeError(f"{path} must be readable by its owner only (chmod 600 {path})")
+    with open(path) as f:
+        key = f.read().strip()
+    if not key:
+        raise RuntimeError(f"{path} is empty")
+    return key.encode()
+
+_client_local = threading.local()
+
+def _drop_server_conn():
+    conn = getattr(_client_local, "conn", None)
+    _client_local.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+def _server_request(op: str, prompt: str, max_new_tokens: int, structured: bool):
+    """
+    Send one request to qwen_server.py over this thread's connection and
+    yield its ('chunk', text) / ('done', text) replies. Errors raised by the
+    server come back as RuntimeError.
+    """
+    conn = getattr(_client_local, "conn", None)
+    if conn is None:
+        conn = _client_local.conn = Client(parse_address(SERVER_ADDRESS), authkey=server_authkey())
+    finished = False
+    try:
+        conn.send((op, prompt, max_new_tokens, structured))
+        while True:
+            if not conn.poll(SERVER_TIMEOUT):
+                raise TimeoutError(f"Qwen server did not answer within {SERVER_TIMEOUT:.0f}s")
+            kind, payload = conn.recv()
+            if kind == "error":
+                finished = True
+                raise RuntimeError(f"Qwen server: {payload}")
+            if kind == "done":
+                finished = True
+            yield kind, payload
+            if finished:
+                return
+    finally:
+        # A reply left half-read (timeout, dropped stream) would desync the connection
+        if not finished:
+            _drop_server_conn()
+
+#This function runs the prompt and gives the final answer
+def generate(prompt: str, max_new_tokens: int = 256, *, structured: bool = False) -> str:
+    if SERVER_ADDRESS:
+        for kind, payload in _server_request("generate", prompt, max_new_tokens, structured):
+            if kind == "done":
+                return payload
+    if BATCH_MAX_SIZE <= 1:
+        return generate_batch([prompt], max_new_tokens, structured)[0]
+    return _batcher.submit(prompt, max_new_tokens, structured).result()
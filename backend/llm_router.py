@@ -1,25 +1,487 @@
 # llm_router.py — simple model router
 
-from typing import Optional
-from llm_qwen import generate as qwen_generate 
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional, Union
+
+import llm_cache
+from metrics import LLM_CACHE, LLM_OUTPUT_CHARS, LLM_REQUESTS, LLM_SECONDS
+from prompts import FORMAT_VERSION
+from llm_guard import GUARDED, LIMIT_MAX, ProviderUnavailable, guard_for, guard_states  # noqa: F401 (re-exported)
 
 try:
-    from llm_openai import generate as openai_generate
+    from llm_openai import generate as openai_generate, stream as openai_stream, agenerate as openai_agenerate
 except Exception:
-    def openai_generate(prompt: str, max_new_tokens: int = 256) -> str:
+    def openai_generate(prompt: str, max_new_tokens: int = 256, *, structured: bool = False) -> str:
+        return "OpenAI backend not configured."
+
+    async def openai_agenerate(prompt: str, max_new_tokens: int = 256, *, structured: bool = False) -> str:
         return "OpenAI backend not configured."
 
-def generate(prompt: str, model_key: Optional[str], max_new_tokens: int = 256) -> str:
+    def openai_stream(prompt: str, max_new_tokens: int = 256, *, structured: bool = False) -> Iterator[str]:
+        yield "OpenAI backend not configured."
+
+# Responses that describe a failure rather than an answer; never cached
+_UNCACHEABLE_PREFIXES = ("[Gemini]", "OpenAI backend not configured", "Empty prompt")
+
+
+def _canonical_model(model_key: Optional[str]) -> str:
     mk = (model_key or "openai").lower().strip()
     if mk in ("openai", "gpt", "chatgpt") or mk.startswith("gpt-"):
-        return openai_generate(prompt, max_new_tokens=max_new_tokens)
+        return "openai"
+    if mk in ("qwen", "gemini"):
+        return mk
+    raise ValueError(f"Unknown model '{model_key}'. Use one of: qwen, gemini.")
+
+
+def _cache_params(max_new_tokens: int, structured: bool) -> dict:
+    # Responses made under an older answer format must not be served again;
+    # free-form prompts get no format, so never share entries with them
+    return {"max_new_tokens": max_new_tokens, "format": FORMAT_VERSION if structured else None}
+
+
+def _cache_get(mk: str, prompt: str, params: dict) -> Optional[str]:
+    cached = llm_cache.get(mk, prompt, params)
+    LLM_CACHE.inc(backend=mk, result="miss" if cached is None else "hit")
+    return cached
+
+
+def _cacheable(text: str) -> bool:
+    return bool(text and text.strip()) and not text.startswith(_UNCACHEABLE_PREFIXES)
+
+
+# --- Per-backend latency/error statistics ---
+# The router keeps a rolling window of recent calls per backend; the hedging
+# policy below derives each backend's p95 from it.
+STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+
+
+class _LatencyWindow:
+    def __init__(self, size: int):
+        self._samples: deque = deque(maxlen=size)  # (seconds, ok)
+        self._abandoned = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool):
+        with self._lock:
+            self._samples.append((seconds, ok))
+
+    def record_abandoned(self):
+        with self._lock:
+            self._abandoned += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = list(self._samples)
+            abandoned = self._abandoned
+        ok = sorted(sec for sec, good in samples if good)
+
+        def pct(p):
+            return ok[min(len(ok) - 1, int(p * len(ok)))] if ok else None
+
+        return {
+            "samples": len(samples),
+            "error_rate": (1 - len(ok) / len(samples)) if samples else 0.0,
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "abandoned": abandoned,
+        }
+
+
+_STATS = {mk: _LatencyWindow(STATS_WINDOW) for mk in ("openai", "qwen", "gemini")}
+
+
+def backend_stats() -> dict:
+    """Rolling latency (seconds) and error-rate summary per backend."""
+    return {mk: w.snapshot() for mk, w in _STATS.items()}
+
+
+def _record_stats(mk: str, seconds: float, error):
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        # Abandoned, typically the slower side of a hedge: its elapsed time
+        # is only a lower bound on the real latency, so it stays out of the
+        # window behind the percentiles (and the hedge delay) and is counted
+        _STATS[mk].record_abandoned()
+        return
+    _STATS[mk].record(seconds, error is None)
+
+
+def _backend_generate(mk: str, prompt: str, max_new_tokens: int, structured: bool) -> str:
+    # Circuit breaker / concurrency limit (llm_guard): raises ProviderUnavailable
+    # before touching a provider that is failing or saturated
+    guard = guard_for(mk)
+    if guard is not None:
+        ticket = _acquire(guard, mk, "generate")
+    started = time.monotonic()
+    error = None
+    text = ""
+    try:
+        text = _call_backend(mk, prompt, max_new_tokens, structured)
+        return text
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        _record_stats(mk, elapsed, error)
+        _observe(mk, "generate", elapsed, error, text)
+        if guard is not None:
+            guard.release(ticket, elapsed, error)
+
+
+def _acquire(guard, mk: str, mode: str):
+    try:
+        return guard.acquire()
+    except ProviderUnavailable:
+        LLM_REQUESTS.inc(backend=mk, mode=mode, outcome="rejected")
+        raise
+
+
+def _observe(mk: str, mode: str, seconds: float, error, text: str):
+    LLM_SECONDS.observe(seconds, backend=mk, mode=mode)
+    LLM_REQUESTS.inc(backend=mk, mode=mode, outcome="ok" if error is None else "error")
+    if text:
+        LLM_OUTPUT_CHARS.inc(len(text), backend=mk)
+
+
+def _call_backend(mk: str, prompt: str, max_new_tokens: int, structured: bool) -> str:
+    if mk == "openai":
+        return openai_generate(prompt, max_new_tokens=max_new_tokens, structured=structured)
     if mk == "qwen":
-        return qwen_generate(prompt, max_new_tokens=max_new_tokens)
-    elif mk == "gemini":
-        # Lazy import so google-generativeai is required only when used.
-        from gemini import generate as gemini_generate  # type: ignore
-        return gemini_generate(prompt, max_new_tokens=max_new_tokens)
-    else:
-        raise ValueError(f"Unknown model '{model_key}'. Use one of: qwen, gemini.")
+        # Lazy import: the Qwen weights load on the first qwen request, not at startup.
+        from llm_qwen import generate as qwen_generate
+        return qwen_generate(prompt, max_new_tokens=max_new_tokens, structured=structured)
+    # Lazy import so google-generativeai is required only when used.
+    from gemini import generate as gemini_generate  # type: ignore
+    return gemini_generate(prompt, max_new_tokens=max_new_tokens, structured=structured)
+
+
+def _backend_stream(mk: str, prompt: str, max_new_tokens: int, structured: bool) -> Iterator[str]:
+    # Lazy: nothing happens (and no concurrency slot is taken) until the first
+    # next(); the slot is then held until the stream ends or the client closes it
+    guard = guard_for(mk)
+    if guard is not None:
+        ticket = _acquire(guard, mk, "stream")
+    started = time.monotonic()
+    error = None
+    chars = 0
+    try:
+        for chunk in _open_stream(mk, prompt, max_new_tokens, structured):
+            chars += len(chunk)
+            yield chunk
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        if not isinstance(error, GeneratorExit):
+            _observe(mk, "stream", elapsed, error, "")
+        if chars:
+            LLM_OUTPUT_CHARS.inc(chars, backend=mk)
+        if guard is not None:
+            guard.release(ticket, elapsed, error)
+
+
+def _open_stream(mk: str, prompt: str, max_new_tokens: int, structured: bool) -> Iterator[str]:
+    if mk == "openai":
+        return openai_stream(prompt, max_new_tokens=max_new_tokens, structured=structured)
+    if mk == "qwen":
+        from llm_qwen import stream as qwen_stream
+        return qwen_stream(prompt, max_new_tokens=max_new_tokens, structured=structured)
+    from gemini import stream as gemini_stream  # type: ignore
+    return gemini_stream(prompt, max_new_tokens=max_new_tokens, structured=structured)
+
+
+def generate(prompt: str, model_key: Optional[str], max_new_tokens: int = 256, *, structured: bool = False) -> str:
+    """
+    Generate with the given backend. structured=True (prompts from
+    prompts.build_structured_prompt) asks for the shared answer format and
+    stops at its END_MARKER; free-form prompts are sent as they are.
+    """
+    mk = _canonical_model(model_key)
+    if not llm_cache.enabled_for(mk):
+        return _backend_generate(mk, prompt, max_new_tokens, structured)
+
+    # Opt-in response cache (LLM_CACHE_MODELS): identical requests skip the model
+    params = _cache_params(max_new_tokens, structured)
+    cached = _cache_get(mk, prompt, params)
+    if cached is not None:
+        return cached
+    text = _backend_generate(mk, prompt, max_new_tokens, structured)
+    if _cacheable(text):
+        llm_cache.put(mk, prompt, params, text)
+    return text
+
+
+async def _backend_agenerate(mk: str, prompt: str, max_new_tokens: int, structured: bool) -> str:
+    guard = guard_for(mk)
+    if guard is not None:
+        ticket = _acquire(guard, mk, "generate")
+    started = time.monotonic()
+    error = None
+    text = ""
+    try:
+        text = await _acall_backend(mk, prompt, max_new_tokens, structured)
+        return text
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        _record_stats(mk, elapsed, error)
+        _observe(mk, "generate", elapsed, error, text)
+        if guard is not None:
+            guard.release(ticket, elapsed, error)
+
+
+async def _acall_backend(mk: str, prompt: str, max_new_tokens: int, structured: bool) -> str:
+    if mk == "openai":
+        return await openai_agenerate(prompt, max_new_tokens=max_new_tokens, structured=structured)
+    if mk == "qwen":
+        # Local CPU inference: run it on the default executor so the event loop stays free
+        from llm_qwen import generate as qwen_generate
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: qwen_generate(prompt, max_new_tokens=max_new_tokens, structured=structured))
+    from gemini import agenerate as gemini_agenerate  # type: ignore
+    return await gemini_agenerate(prompt, max_new_tokens=max_new_tokens, structured=structured)
+
+
+async def agenerate(prompt: str, model_key: Optional[str], max_new_tokens: int = 256, *,
+                    structured: bool = False) -> str:
+    """
+    Async counterpart of generate(): remote calls are awaited on the event loop
+    (AsyncOpenAI, Gemini generate_content_async), so one process can hold many
+    in-flight requests without a thread each. Uses the same response cache.
+    """
+    mk = _canonical_model(model_key)
+    if not llm_cache.enabled_for(mk):  # in-memory settings check
+        return await _backend_agenerate(mk, prompt, max_new_tokens, structured)
+
+    # The cache lookups and writes hit SQLite; keep them off the event loop
+    params = _cache_params(max_new_tokens, structured)
+    cached = await asyncio.to_thread(_cache_get, mk, prompt, params)
+    if cached is not None:
+        return cached
+    text = await _backend_agenerate(mk, prompt, max_new_tokens, structured)
+    if _cacheable(text):
+        await asyncio.to_thread(llm_cache.put, mk, prompt, params, text)
+    return text
+
+
+# --- Hedging / failover policy ---
+# LLM_FALLBACKS lists, per primary backend, where to go next, e.g.
+#   LLM_FALLBACKS="gemini:openai,openai:gemini"
+# On an error the next backend in the chain is tried. With LLM_HEDGE=1 the
+# next backend is also started ("hedged") when the current one has not
+# answered within its rolling p95 latency (LLM_HEDGE_DEFAULT_MS until
+# LLM_HEDGE_MIN_SAMPLES calls have been seen); the first answer wins.
+def _parse_fallbacks(raw: str) -> dict:
+    chains: dict = {}
+    for part in raw.split(","):
+        primary, _, rest = part.partition(":")
+        try:
+            chain = [_canonical_model(primary)] + [_canonical_model(b) for b in rest.split(":") if b.strip()]
+        except ValueError:
+            continue
+        if len(chain) > 1:
+            chains[chain[0]] = chain[1:]
+    return chains
+
+
+FALLBACKS = _parse_fallbacks(os.getenv("LLM_FALLBACKS", ""))
+HEDGE = os.getenv("LLM_HEDGE") == "1"
+HEDGE_DEFAULT_MS = float(os.getenv("LLM_HEDGE_DEFAULT_MS", "4000"))
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Pool for hedged calls (LLM_HEDGE=1 only). The providers' concurrency
+# limits (llm_guard) are what bound the calls in flight, so by default the
+# pool never becomes the tighter cap: LLM_LIMIT_MAX per guarded provider
+# plus as much again for local Qwen. Threads are only started as needed.
+_hedge_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("LLM_HEDGE_MAX_WORKERS") or int(LIMIT_MAX) * (len(GUARDED) + 1)),
+    thread_name_prefix="llm-hedge",
+)
+
+
+def _hedge_delay(mk: str) -> float:
+    snap = _STATS[mk].snapshot()
+    if snap["p95"] is not None and snap["samples"] >= HEDGE_MIN_SAMPLES:
+        return snap["p95"]
+    return HEDGE_DEFAULT_MS / 1000.0
+
+
+def generate_routed(prompt: str, model_key: Optional[str], max_new_tokens: int = 256, *,
+                    structured: bool = False) -> tuple[str, str]:
+    """
+    generate() under the hedging/failover policy.
+    Returns (text, backend that produced it). Without a policy for this
+    model it is just generate() on the requested backend.
+    """
+    mk = _canonical_model(model_key)
+    chain = [mk] + FALLBACKS.get(mk, [])
+    if len(chain) == 1:
+        return generate(prompt, mk, max_new_tokens=max_new_tokens, structured=structured), mk
+
+    errors: list = []
+    if not HEDGE:
+        # Plain failover: one backend at a time, in the caller's thread
+        for backend in chain:
+            try:
+                return generate(prompt, backend, max_new_tokens=max_new_tokens, structured=structured), backend
+            except Exception as e:
+                errors.append(e)
+        raise errors[-1]
+
+    pending: dict = {}
+    nxt = 0
+
+    def launch():
+        nonlocal nxt
+        backend = chain[nxt]
+        nxt += 1
+        pending[_hedge_pool.submit(generate, prompt, backend, max_new_tokens, structured=structured)] = backend
+
+    launch()
+    while pending:
+        # While there is a backend left to hedge to, wait at most the latest one's p95
+        timeout = _hedge_delay(chain[nxt - 1]) if nxt < len(chain) else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            launch()
+            continue
+        for fut in done:
+            backend = pending.pop(fut)
+            try:
+                text = fut.result()
+            except Exception as e:
+                errors.append(e)
+                if nxt < len(chain):
+                    launch()  # fail over
+                continue
+            # First answer wins. Threads already running cannot be interrupted;
+            # their results are simply discarded.
+            for other in pending:
+                other.cancel()
+            return text, backend
+    raise errors[-1]
+
+
+async def agenerate_routed(prompt: str, model_key: Optional[str], max_new_tokens: int = 256, *,
+                           structured: bool = False) -> tuple[str, str]:
+    """Async generate_routed(); the losing request is actually cancelled."""
+    mk = _canonical_model(model_key)
+    chain = [mk] + FALLBACKS.get(mk, [])
+    if len(chain) == 1:
+        return await agenerate(prompt, mk, max_new_tokens=max_new_tokens, structured=structured), mk
+
+    pending: dict = {}
+    errors: list = []
+    nxt = 0
+
+    def launch():
+        nonlocal nxt
+        backend = chain[nxt]
+        nxt += 1
+        pending[asyncio.ensure_future(agenerate(prompt, backend, max_new_tokens, structured=structured))] = backend
+
+    launch()
+    try:
+        while pending:
+            timeout = _hedge_delay(chain[nxt - 1]) if HEDGE and nxt < len(chain) else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+            for task in done:
+                backend = pending.pop(task)
+                try:
+                    text = task.result()
+                except Exception as e:
+                    errors.append(e)
+                    if nxt < len(chain):
+                        launch()
+                    continue
+                return text, backend
+        raise errors[-1]
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def generate_many(
+    requests: list[tuple[str, Optional[str], bool]],
+    max_new_tokens: int = 256,
+    concurrency: int = 4,
+) -> list[Union[str, Exception]]:
+    """
+    Run many (prompt, model_key, structured) generations concurrently.
+    Remote backends are called in parallel, at most `concurrency` at a time.
+    Qwen requests are all submitted at once so the micro-batcher can pad them
+    into shared model.generate calls. Returns one entry per request, in
+    order: the text, or the exception that request raised.
+    """
+    results: list[Union[str, Exception]] = [None] * len(requests)  # type: ignore[list-item]
+    local, remote = [], []
+    for i, (prompt, model_key, structured) in enumerate(requests):
+        try:
+            mk = _canonical_model(model_key)
+        except ValueError as e:
+            results[i] = e
+            continue
+        (local if mk == "qwen" else remote).append((i, prompt, mk, structured))
+
+    def run(job):
+        i, prompt, mk, structured = job
+        try:
+            results[i] = generate(prompt, mk, max_new_tokens=max_new_tokens, structured=structured)
+        except Exception as e:
+            results[i] = e
+
+    pools = []
+    if remote:
+        pools.append((ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(remote)))), remote))
+    if local:
+        pools.append((ThreadPoolExecutor(max_workers=len(local)), local))
+    for pool, jobs in pools:
+        for job in jobs:
+            pool.submit(run, job)
+    for pool, _ in pools:
+        pool.shutdown(wait=True)
+    return results
+
+
+def stream(prompt: str, model_key: Optional[str], max_new_tokens: int = 256, *,
+           structured: bool = False) -> Iterator[str]:
+    """Same routing as generate(), but yields text chunks as the backend produces them."""
+    mk = _canonical_model(model_key)
+    if not llm_cache.enabled_for(mk):
+        return _backend_stream(mk, prompt, max_new_tokens, structured)
+    return _cached_stream(mk, prompt, max_new_tokens, structured)
+
+
+def _cached_stream(mk: str, prompt: str, max_new_tokens: int, structured: bool) -> Iterator[str]:
+    params = _cache_params(max_new_tokens, structured)
+    cached = _cache_get(mk, prompt, params)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for chunk in _backend_stream(mk, prompt, max_new_tokens, structured):
+        parts.append(chunk)
+        yield chunk
+    text = "".join(parts).strip()
+    if _cacheable(text):
+        llm_cache.put(mk, prompt, params, text)
 
 
+def warmup(model_key: str) -> None:
+    """Load a local backend ahead of the first request (no-op for remote APIs)."""
+    if (model_key or "").lower().strip() == "qwen":
+        from llm_qwen import warmup as qwen_warmup
+        qwen_warmup()
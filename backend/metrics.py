@@ -0,0 +1,212 @@
+# metrics.py — in-process counters/histograms exported at GET /metrics
+"""
+A tiny Prometheus-compatible metrics registry (text exposition format 0.0.4),
+so the app can be scraped without extra dependencies.
+
+    REQUESTS = Counter("llm_requests_total", "LLM calls", ("backend", "outcome"))
+    REQUESTS.inc(backend="qwen", outcome="ok")
+
+    LATENCY = Histogram("db_query_duration_seconds", "SQLite calls", ("op",))
+    with LATENCY.time(op="save_qa"):
+        ...
+
+    @LATENCY.timed(op="list_topics")
+    def list_topics(...): ...
+
+Recording is a dict lookup and a few additions under a lock per metric, so
+it is cheap enough for every request. Gauges can be given a callback that is
+only evaluated when /metrics is scraped.
+
+Metrics are per process: with several server processes, scrape each one
+(or sum them in the query).
+"""
+
+from __future__ import annotations
+
+import bisect
+import functools
+import math
+import threading
+import time
+from typing import Callable, Optional
+
+# Default latency buckets (seconds): sub-millisecond DB calls up to minute-long generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: list = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback: Optional[Callable] = None):
+        """
+        callback (optional) is called at scrape time and returns either a
+        number (no labels) or {label value tuple: number}.
+        """
+        super().__init__(name, documentation, labelnames)
+        self._values: dict = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> list:
+        if self._callback is not None:
+            try:
+                got = self._callback()
+            except Exception:
+                got = None  # never let a broken callback fail the scrape
+            items = sorted(got.items()) if isinstance(got, dict) else ([((), got)] if got is not None else [])
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self._header() + [
+            f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}" for k, v in items
+        ]
+
+
+class _Timer:
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started, **self._labels)
+        return False
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self._bounds = tuple(sorted(buckets))
+        self._series: dict = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self._bounds) + 3)
+            series[i] += 1  # non-cumulative here; cumulated when rendered
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels) -> _Timer:
+        """Context manager observing the elapsed wall time."""
+        return _Timer(self, labels)
+
+    def timed(self, **labels):
+        """Decorator observing each call's wall time."""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                with _Timer(self, labels):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = self._header()
+        for key, series in items:
+            running = 0
+            for bound, n in zip(self._bounds + (math.inf,), series):
+                running += n
+                le = 'le="' + _fmt_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(series[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text format."""
+    lines: list = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# --- Metrics shared across modules ---
+HTTP_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce the response (for streams: until the response starts)",
+    ("method", "route", "status"),
+)
+LLM_SECONDS = Histogram("llm_request_duration_seconds", "Backend generation time", ("backend", "mode"))
+LLM_REQUESTS = Counter("llm_requests_total", "Backend generations by outcome (ok, error, rejected)",
+                       ("backend", "mode", "outcome"))
+LLM_OUTPUT_CHARS = Counter("llm_output_chars_total", "Characters generated (about 4 per token)", ("backend",))
+LLM_CACHE = Counter("llm_cache_requests_total", "Response cache lookups", ("backend", "result"))
+DB_SECONDS = Histogram("db_query_duration_seconds", "Time spent in db.py calls", ("op",))
+DB_WRITE_GROUP = Histogram("db_write_group_size", "Writes committed together by the db writer thread",
+                           buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+JWT_SECONDS = Histogram("jwt_verify_duration_seconds", "Access token verification time")
@@ -0,0 +1,71 @@
+# prompts.py — prompt text shared by the API and the model backends
+
+# Fixed opening of every structured /generate prompt. It comes before the
+# per-request selections so that all structured prompts share it verbatim;
+# the Qwen backend precomputes its attention cache once (llm_qwen PREFIXES).
+STRUCTURED_PROMPT_PREFIX = (
+    "Create ONE short, correct, elementary-level math word problem. "
+    "Keep it clear and age-appropriate."
+)
+
+
+def build_structured_prompt(country: str, grade: str, language: str, topic: str, lo: str = "") -> str:
+    """Prompt for the selections made in the generator UI."""
+    return (
+        STRUCTURED_PROMPT_PREFIX
+        + f" It is for grade {grade} and about {topic}."
+        + (f" Align the question with this learning objective: '{lo}'." if lo else "")
+        + f" Use culturally appropriate examples for {country}."
+        + f" Language: {language}."
+    )
+
+
+# --- Answer format shared by all backends ---
+# Structured generations (structured=True in llm_router, set by the /generate
+# routes for prompts from build_structured_prompt) ask for these five
+# sections, in this order, followed by END_MARKER. Free-form prompts such as
+# /api/chat messages get neither the instructions nor the stop. OpenAI and
+# Gemini get END_MARKER as a stop sequence; Qwen stops through llm_qwen's
+# stopping criterion (answer_complete). Either way the model stops decoding
+# as soon as the answer is complete instead of running on to max_new_tokens.
+FORMAT_SECTIONS = (
+    ("Math Word Problem", "one concise sentence describing the scenario"),
+    ("Question", "the single question that should be answered"),
+    ("Answer", "a short, correct answer that solves the problem"),
+    ("Learning Objective", "restate the learning objective from the prompt, or write 'Not specified.' if none is given"),
+    ("Culturally Appropriate Example", "one short sentence connecting the context to the region or culture mentioned; if none, write 'Not specified.'"),
+)
+END_MARKER = "<<END>>"
+# Bumped whenever the instructions change, so cached responses are not reused
+FORMAT_VERSION = 2
+
+FORMAT_INSTRUCTIONS = (
+    "Respond using the following structure exactly. Keep the section titles in bold markdown using double asterisks and end them with a colon:\n"
+    + "\n".join(f"**{title}:**\n{{{hint}}}\n" for title, hint in FORMAT_SECTIONS)
+    + f"Do not add extra sections or commentary. Write {END_MARKER} on its own line after the last section."
+)
+
+_LAST_HEADING = f"{FORMAT_SECTIONS[-1][0]}:"
+
+
+def with_format(prompt: str) -> str:
+    """The prompt with FORMAT_INSTRUCTIONS appended."""
+    return f"{prompt.strip()}\n\n{FORMAT_INSTRUCTIONS}"
+
+
+def answer_complete(text: str) -> bool:
+    """True once `text` contains END_MARKER or a finished line under the last section."""
+    if END_MARKER in text:
+        return True
+    _, found, tail = text.partition(_LAST_HEADING)
+    if not found:
+        return False
+    tail = tail.lstrip("* \t")
+    if tail.startswith("\n"):
+        tail = tail[1:]
+    return "\n" in tail and bool(tail.split("\n", 1)[0].strip())
+
+
+def strip_end_marker(text: str) -> str:
+    """Cut the answer at END_MARKER (and drop anything the model wrote after it)."""
+    return text.split(END_MARKER, 1)[0].rstrip()
@@ -0,0 +1,255 @@
+# qwen_server.py — standalone multi-process Qwen inference server
+"""
+Runs the Qwen model in N worker processes, outside the web server, so local
+inference scales across cores independently of the HTTP tier and Flask
+workers do not each load their own copy of the weights.
+
+    cd backend
+    python qwen_server.py --workers 4                      # listens on 127.0.0.1:7071
+    QWEN_SERVER_ADDRESS=127.0.0.1:7071 python app.py       # llm_qwen becomes a client
+
+Web processes connect over a local socket (multiprocessing.connection) and
+send ("generate" | "stream", prompt, max_new_tokens, structured), where
+structured asks for the shared answer format. Connections are
+authenticated with QWEN_SERVER_AUTHKEY or, when that is unset, a random key
+the server writes to QWEN_SERVER_AUTHKEY_FILE (mode 0600) on first start;
+clients running as the same user read the same file. Authenticated peers can
+make the server unpickle arbitrary data, so it only listens on loopback or a
+Unix socket unless --allow-remote is given. Requests go onto one shared
+queue; each idle worker takes the next requests that arrived within
+QWEN_BATCH_MAX_WAIT_MS (up to QWEN_BATCH_MAX_SIZE) and runs them as one
+padded batch. Streams are served one per worker.
+
+Memory: by default each worker loads the model itself (the safetensors file
+is mmap'd, so loads come from the shared page cache, but every worker keeps
+its own resident weights). With --share-weights (Linux) the server loads the
+model once and forks the workers, which then share the read-only weight
+pages copy-on-write. QWEN_PROFILE and the other QWEN_* settings apply to the
+workers as usual; QWEN_NUM_THREADS defaults to cores / workers.
+"""
+
+from __future__ import annotations
+
+import argparse
+import ipaddress
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import llm_qwen
+
+DEFAULT_ADDRESS = "127.0.0.1:7071"
+
+
+def _collect(jobs, max_batch_size: int, max_wait: float) -> list:
+    # Same policy as llm_qwen._MicroBatcher, across processes
+    batch = [jobs.get()]
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_batch_size and batch[-1][1] == "generate":
+        remaining = deadline - time.monotonic()
+        try:
+            batch.append(jobs.get(timeout=remaining) if remaining > 0 else jobs.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _failure(e: BaseException) -> str:
+    return f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+
+def _worker(index: int, jobs, results, preloaded: bool):
+    # This process does the inference itself, whatever QWEN_SERVER_ADDRESS says
+    llm_qwen.SERVER_ADDRESS = None
+    if preloaded:
+        # Thread settings are per process; the forked copy starts with the parent's
+        import torch
+        llm_qwen._set_threads(torch)
+    llm_qwen.warmup()
+
+    while True:
+        batch = _collect(jobs, llm_qwen.BATCH_MAX_SIZE, llm_qwen.BATCH_MAX_WAIT_MS / 1000.0)
+        # Lets the server fail these requests if this process dies holding them
+        results.put((None, "taken", (index, [job[0] for job in batch])))
+        generates = [job for job in batch if job[1] == "generate"]
+        streams = [job for job in batch if job[1] == "stream"]
+
+        if generates:
+            try:
+                texts = llm_qwen.generate_batch([p for _, _, p, _, _ in generates],
+                                                [n for _, _, _, n, _ in generates],
+                                                [f for _, _, _, _, f in generates])
+            except Exception as e:
+                for rid, *_ in generates:
+                    results.put((rid, "error", _failure(e)))
+            else:
+                for (rid, *_), text in zip(generates, texts):
+                    results.put((rid, "done", text))
+
+        # A failed or stalled generation (llm_qwen.stream raises, TimeoutError
+        # after QWEN_STREAM_TIMEOUT) becomes an error reply and this worker
+        # goes back to the shared queue
+        for rid, _, prompt, max_new_tokens, structured in streams:
+            try:
+                parts = []
+                for chunk in llm_qwen.stream(prompt, max_new_tokens, structured=structured):
+                    parts.append(chunk)
+                    results.put((rid, "chunk", chunk))
+                results.put((rid, "done", "".join(parts)))
+            except Exception as e:
+                results.put((rid, "error", _failure(e)))
+
+
+class QwenServer:
+    def __init__(self, workers: int, share_weights: bool = False):
+        if share_weights:
+            # Load (and quantize/compile per QWEN_PROFILE) once; forked workers inherit it
+            llm_qwen.SERVER_ADDRESS = None
+            llm_qwen.warmup()
+        self._ctx = mp.get_context("fork" if share_weights else "spawn")
+        self._preloaded = share_weights
+        self._jobs = self._ctx.Queue()
+        # SimpleQueue writes synchronously: a worker that crashes right after
+        # announcing a batch has still delivered the announcement
+        self._results = self._ctx.SimpleQueue()
+        self._pending: dict[int, queue.Queue] = {}
+        self._ids = itertools.count()
+        self._procs: list = [None] * workers
+        self._taken: list[set] = [set() for _ in range(workers)]  # rids each worker is handling
+        self._owner: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+        for i in range(workers):
+            self._start_worker(i)
+        threading.Thread(target=self._dispatch, name="qwen-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="qwen-monitor", daemon=True).start()
+
+    def _start_worker(self, i: int):
+        p = self._ctx.Process(
+            target=_worker,
+            args=(i, self._jobs, self._results, self._preloaded),
+            name=f"qwen-worker-{i}",
+            daemon=True,
+        )
+        p.start()
+        self._procs[i] = p
+
+    def _monitor(self):
+        # Replace crashed workers and fail the requests they were holding
+        while True:
+            time.sleep(5)
+            for i, p in enumerate(self._procs):
+                if not p.is_alive():
+                    print(f"qwen worker {i} exited with {p.exitcode}; restarting")
+                    self._fail_taken(i, f"Qwen worker exited with {p.exitcode}")
+                    self._start_worker(i)
+
+    def _fail_taken(self, i: int, message: str):
+        with self._lock:
+            rids, self._taken[i] = self._taken[i], set()
+            for rid in rids:
+                self._owner.pop(rid, None)
+        for rid in rids:
+            replies = self._pending.get(rid)
+            if replies is not None:
+                replies.put(("error", message))
+
+    def _dispatch(self):
+        while True:
+            rid, kind, payload = self._results.get()
+            if kind == "taken":
+                i, rids = payload
+                with self._lock:
+                    self._taken[i].update(rids)
+                    self._owner.update((r, i) for r in rids)
+                continue
+            if kind != "chunk":
+                with self._lock:
+                    i = self._owner.pop(rid, None)
+                    if i is not None:
+                        self._taken[i].discard(rid)
+            replies = self._pending.get(rid)
+            if replies is not None:
+                replies.put((kind, payload))
+
+    def serve(self, conn):
+        """Answer requests from one client connection until it closes."""
+        try:
+            while True:
+                op, prompt, max_new_tokens, structured = conn.recv()
+                rid = next(self._ids)
+                replies = self._pending[rid] = queue.Queue()
+                try:
+                    if op not in ("generate", "stream"):
+                        conn.send(("error", f"unknown operation {op!r}"))
+                        continue
+                    self._jobs.put((rid, op, prompt, int(max_new_tokens), bool(structured)))
+                    while True:
+                        try:
+                            kind, payload = replies.get(timeout=llm_qwen.SERVER_TIMEOUT)
+                        except queue.Empty:
+                            # The client gives up after the same time; never leave this thread waiting
+                            kind, payload = "error", f"no reply within {llm_qwen.SERVER_TIMEOUT:.0f}s"
+                        conn.send((kind, payload))
+                        if kind != "chunk":
+                            break
+                finally:
+                    self._pending.pop(rid, None)
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve Qwen generations to the web processes.")
+    ap.add_argument("--address", default=os.getenv("QWEN_SERVER_ADDRESS") or DEFAULT_ADDRESS,
+                    help="host:port or Unix socket path (default QWEN_SERVER_ADDRESS or %(default)s)")
+    ap.add_argument("--workers", type=int, default=int(os.getenv("QWEN_SERVER_WORKERS", "2")))
+    ap.add_argument("--share-weights", action="store_true",
+                    help="load once and fork the workers so they share the weights (Linux)")
+    ap.add_argument("--allow-remote", action="store_true",
+                    help="allow listening on a non-loopback TCP address")
+    args = ap.parse_args()
+
+    address = llm_qwen.parse_address(args.address)
+    if isinstance(address, tuple) and not args.allow_remote and not _is_loopback(address[0]):
+        ap.error(f"{args.address} is not a loopback address; pass --allow-remote to listen on it")
+    authkey = llm_qwen.server_authkey(create=True)
+
+    workers = max(1, args.workers)
+    if not llm_qwen.NUM_THREADS:
+        # Split the cores between workers instead of each one using all of them
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        os.environ["QWEN_NUM_THREADS"] = str(threads)
+        llm_qwen.NUM_THREADS = threads
+
+    server = QwenServer(workers, share_weights=args.share_weights)
+    # The handshake runs in accept(); with the default backlog of 1, a burst
+    # of web threads connecting at once can leave some stuck before it
+    listener = Listener(address, backlog=128, authkey=authkey)
+    print(f"Qwen server listening on {args.address} with {workers} worker(s)")
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:  # e.g. a client with the wrong authkey
+            print("qwen server: rejected connection:", e)
+            continue
+        threading.Thread(target=server.serve, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    main()
@@ -16,3 +16,53 @@ async function apiRequest(path, { method = "GET", body, auth = false } = {}) {
   }
   return data;
 }
+
+// POST to a Server-Sent Events endpoint and call onEvent(name, data) per message.
+// Resolves once the stream ends.
+async function apiStream(path, { body, auth = false, onEvent } = {}) {
+  const headers = { "Content-Type": "application/json", Accept: "text/event-stream" };
+  if (auth) {
+    const token = localStorage.getItem("token");
+    if (token) headers["Authorization"] = `Bearer ${token}`;
+  }
+  const res = await fetch(`${BASE_URL}${path}`, {
+    method: "POST",
+    headers,
+    body: body ? JSON.stringify(body) : undefined,
+  });
+  if (!res.ok) {
+    const data = await res.json().catch(() => ({}));
+    const msg = data?.error || data?.msg || data?.message || `Request failed (${res.status})`;
+    throw new Error(msg);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Messages are separated by a blank line
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = "message";
+      const dataLines = [];
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+      }
+      if (!dataLines.length) continue;
+      let data;
+      try {
+        data = JSON.parse(dataLines.join("\n"));
+      } catch {
+        continue;
+      }
+      if (onEvent) onEvent(event, data);
+    }
+  }
+}
@@ -12,8 +12,13 @@ const els = {
   emptyState: $("emptyState"),   // optional (illustrated empty box)
   clearAllBtn: $("clearAllBtn"), // optional (Clear History button)
   footer: $("historyFooter"),
+  search: $("historySearch"),    // optional (full-text search box)
 };
 
+// Cursor-paginated loading state (infinite scroll)
+const PAGE_SIZE = 20;
+const pager = { cursor: "", done: false, loading: false, observer: null, sentinel: null, seq: 0, abort: null };
+
 function esc(s) {
   return String(s ?? "").replace(/[&<>"']/g, (c) =>
     ({ "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#39;" }[c])
@@ -82,12 +87,28 @@ function showConfirmDialog({ title = "Confirm", message = "Are you sure?", confi
 
 
 // ===== API calls =====
-async function apiFetchHistory(token) {
-  const res = await fetch(`${API_BASE}/history?limit=50`, {
+async function apiFetchHistory(token, cursor = "", signal = undefined) {
+  const url = `${API_BASE}/history?limit=${PAGE_SIZE}&before=${encodeURIComponent(cursor)}`;
+  const res = await fetch(url, {
     headers: { Authorization: `Bearer ${token}` },
+    signal,
   });
   if (!res.ok) throw new Error(`History error ${res.status}`);
-  return res.json();
+  return res.json(); // { items, next_cursor }
+}
+
+async function apiSearchHistory(token, q) {
+  const url = `${API_BASE}/history/search?q=${encodeURIComponent(q)}&limit=50`;
+  const res = await fetch(url, {
+    headers: { Authorization: `Bearer ${token}` },
+  });
+  if (!res.ok) throw new Error(`Search error ${res.status}`);
+  return res.json(); // { items }
+}
+
+// Escape a search snippet but keep the server's <mark> highlights
+function snippetHtml(s) {
+  return esc(s).replace(/&lt;mark&gt;/g, "<mark>").replace(/&lt;\/mark&gt;/g, "</mark>");
 }
 
 async function apiDeleteAll(token) {
@@ -108,11 +129,11 @@ async function apiDeleteOne(token, id) {
   return true;
 }
 
-function renderItems(items) {
+function renderItems(items, { append = false } = {}) {
   if (!els.list) return;
 
-  els.list.innerHTML = "";
-  if (!items || !items.length) {
+  if (!append) els.list.innerHTML = "";
+  if (!append && (!items || !items.length)) {
     showEmpty();
     if (els.clearAllBtn) els.clearAllBtn.classList.add("d-none"); // hide button if empty
     return;
@@ -121,13 +142,9 @@ function renderItems(items) {
   // Show clear button only if history exists
   if (els.clearAllBtn) els.clearAllBtn.classList.remove("d-none");
 
-  // Newest first if backend isn't sorted
-  const sorted = [...items].sort(
-    (a, b) => new Date(b.created_at) - new Date(a.created_at)
-  );
-
-  for (let i = 0; i < sorted.length; i++) {
-    const it = sorted[i] || {};
+  // Backend returns pages newest first
+  for (let i = 0; i < items.length; i++) {
+    const it = items[i] || {};
     const meta = it.meta || {};
 
     // Build meta chips (Aligned LO now matches chip style)
@@ -191,6 +208,8 @@ function renderItems(items) {
 
         ${reviewHtml}
 
+        ${it.snippet ? `<div class="mt-1 small text-secondary"><strong>Match:</strong> ${snippetHtml(it.snippet)}</div>` : ""}
+
         <!-- Delete Button -->
         ${it.qaid ? `<button class="btn btn-sm btn-danger delete-btn-bottom-right" data-del="${esc(it.qaid)}" title="Delete this entry">
           <i class="bi bi-trash3"></i> Delete
@@ -203,6 +222,64 @@ function renderItems(items) {
 
 
 // ===== Page actions =====
+
+// Sentinel below the list; when it scrolls into view the next page loads
+function ensureScrollSentinel() {
+  if (pager.sentinel || !els.list || !("IntersectionObserver" in window)) return;
+  pager.sentinel = document.createElement("div");
+  pager.sentinel.setAttribute("aria-hidden", "true");
+  els.list.after(pager.sentinel);
+  pager.observer = new IntersectionObserver((entries) => {
+    if (entries.some((e) => e.isIntersecting)) loadMoreHistory();
+  }, { rootMargin: "400px" });
+  pager.observer.observe(pager.sentinel);
+}
+
+// Drop any page request in flight, so its response can't land in (or
+// re-arm scrolling for) the list that replaces it
+function resetPager() {
+  if (pager.abort) pager.abort.abort();
+  pager.abort = null;
+  pager.loading = false;
+  pager.seq++;
+}
+
+async function loadMoreHistory() {
+  const token = localStorage.getItem("token");
+  if (!token || pager.loading || pager.done) return;
+
+  const seq = pager.seq;
+  pager.abort = new AbortController();
+  pager.loading = true;
+  try {
+    const first = pager.cursor === "";
+    const data = await apiFetchHistory(token, pager.cursor, pager.abort.signal);
+    if (seq !== pager.seq) return; // a search or reload replaced this list
+    renderItems(data.items || [], { append: !first });
+    pager.cursor = data.next_cursor || "";
+    pager.done = !data.next_cursor;
+  } catch (err) {
+    if (seq !== pager.seq) return;
+    console.error(err);
+    pager.done = true;
+    if (els.list) {
+      els.list.insertAdjacentHTML("beforeend", `
+        <li class="list-group-item text-danger">Failed to load history</li>`);
+    }
+  } finally {
+    if (seq === pager.seq) {
+      pager.loading = false;
+      pager.abort = null;
+    }
+  }
+
+  // Short first pages may not fill the screen; keep going until they do
+  if (!pager.done && pager.sentinel &&
+      pager.sentinel.getBoundingClientRect().top < window.innerHeight) {
+    loadMoreHistory();
+  }
+}
+
 async function loadHistory() {
   const token = localStorage.getItem("token");
   if (!token) {
@@ -212,15 +289,49 @@ async function loadHistory() {
 
   hideBanners();
 
+  resetPager();
+  pager.cursor = "";
+  pager.done = false;
+  if (els.list) els.list.innerHTML = "";
+  ensureScrollSentinel();
+  await loadMoreHistory();
+}
+
+// Search replaces the paged list with ranked matches; clearing the box restores it
+let searchTimer = null;
+let searchSeq = 0;
+
+function onSearchInput() {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(runSearch, 250);
+}
+
+async function runSearch() {
+  const token = localStorage.getItem("token");
+  if (!token) return;
+  const q = (els.search?.value || "").trim();
+  const mySeq = ++searchSeq;
+
+  if (!q) {
+    await loadHistory();
+    return;
+  }
+
+  resetPager();
+  pager.done = true; // pause infinite scroll while showing search results
   try {
-    const data = await apiFetchHistory(token);
-    renderItems(Array.isArray(data) ? data : []);
+    const data = await apiSearchHistory(token, q);
+    if (mySeq !== searchSeq) return; // stale response
+    const items = data.items || [];
+    if (!items.length) {
+      if (els.list) els.list.innerHTML = `
+        <li class="list-group-item text-muted">No matches for “${esc(q)}”</li>`;
+      return;
+    }
+    hideBanners();
+    renderItems(items);
   } catch (err) {
     console.error(err);
-    if (els.list) {
-      els.list.innerHTML = `
-        <li class="list-group-item text-danger">Failed to load history</li>`;
-    }
   }
 }
 
@@ -285,6 +396,11 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // Full-text search box if present
+  if (els.search) {
+    els.search.addEventListener("input", onSearchInput);
+  }
+
   // Clear all button if present
   if (els.clearAllBtn) {
     els.clearAllBtn.addEventListener("click", clearAll);
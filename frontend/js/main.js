@@ -187,32 +187,26 @@ async function onGenerateClick(e) {
     btn.innerHTML = `<span class="spinner-border spinner-border-sm me-2"></span>Generating...`;
     out.textContent = "Generating...";
 
-    const res = await apiRequest("/generate", { method: "POST", body, auth: true });
-    // Format content for cleaner HTML display
-    let formatted = res?.content || "(No content returned)";
-
-    // Clean up LaTeX-style math and symbols
-    formatted = formatted
-      .replace(/\\times/g, "×")                // replace \times → ×
-      .replace(/\\div/g, "÷")                  // replace \div → ÷
-      .replace(/\\pi/g, "π")                   // replace \pi → π
-      .replace(/\\text\{(.*?)\}/g, "$1")       // remove \text{...}
-      .replace(/\\frac\{(.*?)\}\{(.*?)\}/g, "($1 ÷ $2)"); // fraction → (a ÷ b)
-
-    // Markdown bold/italic
-    formatted = formatted
-      .replace(/\*\*(.*?)\*\*/g, "<strong>$1</strong>")  // **bold**
-      .replace(/\*(.*?)\*/g, "<em>$1</em>");             // *italic*
-
-    // Spacing and paragraphs
-    formatted = formatted
-      .replace(/\n{2,}/g, "</p><p>")
-      .replace(/\n/g, "<br>")
-      .replace(/^/, "<p>")
-      .replace(/$/, "</p>");
-
-    // Render result
-    out.innerHTML = formatted;
+    // Stream tokens into the output box as they arrive
+    let streamed = "";
+    let res = null;
+    await apiStream("/generate/stream", {
+      body,
+      auth: true,
+      onEvent: (event, data) => {
+        if (event === "token") {
+          streamed += data.text || "";
+          out.innerHTML = formatOutput(streamed);
+        } else if (event === "done") {
+          res = data;
+        } else if (event === "error") {
+          throw new Error(data.error || "Failed to generate.");
+        }
+      },
+    });
+
+    // Render final result
+    out.innerHTML = formatOutput(res?.content || streamed || "(No content returned)");
 
     lastQaid = res?.qaid || null;
 
@@ -234,6 +228,31 @@ async function onGenerateClick(e) {
   }
 }
 
+// Format model output for cleaner HTML display
+function formatOutput(text) {
+  let formatted = text;
+
+  // Clean up LaTeX-style math and symbols
+  formatted = formatted
+    .replace(/\\times/g, "×")                // replace \times → ×
+    .replace(/\\div/g, "÷")                  // replace \div → ÷
+    .replace(/\\pi/g, "π")                   // replace \pi → π
+    .replace(/\\text\{(.*?)\}/g, "$1")       // remove \text{...}
+    .replace(/\\frac\{(.*?)\}\{(.*?)\}/g, "($1 ÷ $2)"); // fraction → (a ÷ b)
+
+  // Markdown bold/italic
+  formatted = formatted
+    .replace(/\*\*(.*?)\*\*/g, "<strong>$1</strong>")  // **bold**
+    .replace(/\*(.*?)\*/g, "<em>$1</em>");             // *italic*
+
+  // Spacing and paragraphs
+  return formatted
+    .replace(/\n{2,}/g, "</p><p>")
+    .replace(/\n/g, "<br>")
+    .replace(/^/, "<p>")
+    .replace(/$/, "</p>");
+}
+
 // Utility
 function getVal(id) {
   const el = document.getElementById(id);